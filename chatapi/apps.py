@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ChatapiConfig(AppConfig):
+    name = 'chatapi'
+
+    def ready(self):
+        from . import checks  # noqa: F401
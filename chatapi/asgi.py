@@ -2,6 +2,8 @@
 ASGI config for chatapi project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests are served by Django, websocket connections on ``/ws`` receive
+realtime message events.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -13,4 +15,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatapi.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from message_control.realtime import get_fanout, websocket_application  # noqa: E402
+
+# a bad REALTIME_FANOUT configuration fails at startup, not after a write
+get_fanout()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"].rstrip("/") != "/ws":
+            await receive()
+            await send({"type": "websocket.close"})
+            return
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_local_cache(alias="default"):
+    # per-process caches, other workers and commands can't see their entries
+    return settings.CACHES[alias]["BACKEND"] in LOCAL_CACHES
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Favorites and token versions are kept in the default cache, when more
+    than one worker serves the API it has to be shared between them.
+    """
+    if settings.WEB_CONCURRENCY > 1 and is_local_cache():
+        return [Error(
+            f"The default cache ({settings.CACHES['default']['BACKEND']}) is local to each process "
+            f"but WEB_CONCURRENCY is {settings.WEB_CONCURRENCY}.",
+            hint="Set CACHE_BACKEND and CACHE_LOCATION to a shared cache such as memcached.",
+            id="chatapi.E001",
+        )]
+    return []
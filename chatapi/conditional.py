@@ -0,0 +1,57 @@
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET requests whose If-None-Match or If-Modified-Since still
+    match with a 304, before the view queries and serializes its data.
+
+    Views implement get_version(request), returning a cheap fingerprint of
+    everything the response depends on (aggregates, version counters) and
+    the time it last changed, or None when part of it is not timestamped.
+    """
+    conditional_actions = ("list", "retrieve", "get")
+
+    def get_version(self, request):
+        raise NotImplementedError
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.last_modified = None
+
+        action = getattr(self, "action", None) or request.method.lower()
+        if request.method not in ("GET", "HEAD") or action not in self.conditional_actions:
+            return
+
+        version, last_modified = self.get_version(request)
+        fingerprint = json.dumps([request.user.id, request.get_full_path(), request.accepted_media_type, version],
+                                 cls=DjangoJSONEncoder)
+        self.etag = '"%s"' % hashlib.md5(fingerprint.encode()).hexdigest()
+        self.last_modified = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None and response.status_code == 304:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=304)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "etag", None) and response.status_code in (200, 304):
+            response["ETag"] = self.etag
+            if self.last_modified:
+                response["Last-Modified"] = http_date(self.last_modified)
+            patch_vary_headers(response, ("Accept", "Authorization"))
+        return response
@@ -1,5 +1,4 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
-from django.utils import timezone
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
@@ -14,9 +13,8 @@ class IsAuthenticatedCustom(BasePermission):
             return False
         request.user = user
         if request.user and request.user.is_authenticated:
-            from user_control.models import CustomUser
-            CustomUser.objects.filter(id=request.user.id).update(
-                is_online=timezone.now())
+            from user_control.presence import record_presence
+            record_presence(request.user.id)
             return True
         return False
 
@@ -27,9 +25,8 @@ class IsAuthenticatedOrReadCustom(BasePermission):
             return True
 
         if request.user and request.user.is_authenticated:
-            from user_control.models import CustomUser
-            CustomUser.objects.filter(id=request.user.id).update(
-                is_online=timezone.now())
+            from user_control.presence import record_presence
+            record_presence(request.user.id)
             return True
         return False
 
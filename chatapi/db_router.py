@@ -0,0 +1,101 @@
+import random
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+# `replica` is set for the duration of a request that may read from a
+# replica, requests are served on one thread each
+_state = threading.local()
+
+
+def set_read_from_replica(value):
+    previous = getattr(_state, "replica", False)
+    _state.replica = value
+    return previous
+
+
+def reads_from_replica():
+    return getattr(_state, "replica", False)
+
+
+def pin_key(user_id):
+    return f"db-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """
+    Sends the user's reads to the primary for REPLICA_STICKY_SECONDS, so
+    they see their own writes despite replication lag.
+    """
+    cache.set(pin_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return bool(cache.get(pin_key(user_id)))
+
+
+class ReadReplicaRouter:
+    """
+    Reads go to a random DATABASE_REPLICAS alias while the request is
+    allowed to read from a replica, everything else goes to default.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and reads_from_replica():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReadReplicaMiddleware:
+    """
+    Routes safe requests to views with `use_read_replica = True` to the
+    replicas, unless the caller wrote something in the last
+    REPLICA_STICKY_SECONDS. Successful writes pin the caller to default.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        previous = set_read_from_replica(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            set_read_from_replica(previous)
+
+        user_id = getattr(request, "replica_user_id", None)
+        if user_id and request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(user_id)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.DATABASE_REPLICAS:
+            return None
+
+        request.replica_user_id = self.get_user_id(request)
+        view = getattr(view_func, "cls", None)
+        if request.method in SAFE_METHODS and getattr(view, "use_read_replica", False):
+            if not request.replica_user_id or not is_pinned(request.replica_user_id):
+                set_read_from_replica(True)
+        return None
+
+    @staticmethod
+    def get_user_id(request):
+        from user_control.authentication import Authentication
+
+        authorization = request.META.get("HTTP_AUTHORIZATION", "")
+        if not authorization.startswith("Bearer "):
+            return None
+        claims = Authentication.verify_access_token(authorization[7:])
+        return claims["user_id"] if claims else None
@@ -0,0 +1,118 @@
+from operator import attrgetter
+from django.conf import settings
+from django.db.models import Manager
+from django.utils import timezone
+
+
+def format_datetime(value, tz=None):
+    # DateTimeField output with the default ISO 8601 format, in tz
+    if not value:
+        return None
+    if tz is not None and timezone.is_aware(value):
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def format_file(value, context):
+    # FileField output, an absolute URL when the request is known
+    if not value:
+        return None
+    try:
+        url = value.url
+    except AttributeError:
+        return None
+    request = context.get("request", None)
+    return request.build_absolute_uri(url) if request else url
+
+
+def attribute(name):
+    getter = attrgetter(name)
+    return lambda serializer, instance: getter(instance)
+
+
+def datetime_attribute(name):
+    getter = attrgetter(name)
+    return lambda serializer, instance: format_datetime(getter(instance), serializer.timezone)
+
+
+def file_attribute(name):
+    getter = attrgetter(name)
+    return lambda serializer, instance: format_file(getter(instance), serializer.context)
+
+
+def get_related(instance, name):
+    # prefetched rows are read without building a related manager
+    prefetched = getattr(instance, "_prefetched_objects_cache", None)
+    if prefetched and name in prefetched:
+        return prefetched[name]
+    return getattr(instance, name).all()
+
+
+def pk_list(name):
+    return lambda serializer, instance: [item.pk for item in get_related(instance, name)]
+
+
+def method(name):
+    return lambda serializer, instance: getattr(serializer, name)(instance)
+
+
+def nested(name, serializer_class, many=False):
+    getter = attrgetter(name)
+
+    def get(serializer, instance):
+        child = serializer.get_child(serializer_class)
+        if many:
+            return [child.to_representation(item) for item in get_related(instance, name)]
+        value = getter(instance)
+        return None if value is None else child.to_representation(value)
+    return get
+
+
+class FastSerializer:
+    """
+    Read-only counterpart of a ModelSerializer for hot listings.
+
+    `field_accessors` lists (name, accessor) pairs in the output order of
+    the serializer it stands in for, each accessor is built once with the
+    helpers above and called with the serializer and the instance. No
+    fields are bound or introspected per instance, nested serializers are
+    created once per listing. The output has to stay identical to the DRF
+    serializer's, which the parity tests check.
+    """
+    field_accessors = ()
+
+    def __init__(self, instance=None, many=False, context=None, fields=None):
+        self.instance = instance
+        self.many = many
+        self.context = {} if context is None else context
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+        self.accessors = self.field_accessors
+        if fields is not None:
+            self.accessors = tuple((name, accessor) for name, accessor in self.accessors if name in fields)
+        self._children = {}
+
+    @property
+    def field_names(self):
+        return [name for name, _ in self.accessors]
+
+    def get_child(self, serializer_class):
+        child = self._children.get(serializer_class, None)
+        if child is None:
+            child = self._children[serializer_class] = serializer_class(context=self.context)
+        return child
+
+    @property
+    def data(self):
+        if not self.many:
+            return self.to_representation(self.instance)
+        instances = self.instance.all() if isinstance(self.instance, Manager) else self.instance
+        return self.to_representation_many(list(instances))
+
+    def to_representation_many(self, instances):
+        return [self.to_representation(instance) for instance in instances]
+
+    def to_representation(self, instance):
+        return {name: accessor(self, instance) for name, accessor in self.accessors}
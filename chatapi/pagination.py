@@ -0,0 +1,148 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorEncoder(json.JSONEncoder):
+    # keep full microsecond precision, keyset comparisons need exact values
+    def default(self, o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on the values of `ordering` rather than an OFFSET, so every
+    page costs one index range scan and no total count is computed.
+
+    `before` returns the rows that come after the cursor in listing order
+    (older messages for the default newest-first ordering) and `after` the
+    rows that come before it. Requests carrying the legacy `page` parameter
+    are handed to PageNumberPagination.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    before_query_param = "before"
+    after_query_param = "after"
+    legacy_query_param = "page"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        if self.legacy_query_param and self.legacy_query_param in request.query_params:
+            self.legacy = PageNumberPagination()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        before = request.query_params.get(self.before_query_param, None)
+        after = request.query_params.get(self.after_query_param, None)
+
+        ordering = self.ordering
+        self.cursor, self.forward = None, not after
+        if after:
+            self.cursor = self.decode_cursor(after)
+            queryset = queryset.filter(self.get_keyset_filter(self.cursor, forward=False))
+            ordering = self.reverse_ordering()
+        elif before:
+            self.cursor = self.decode_cursor(before)
+            queryset = queryset.filter(self.get_keyset_filter(self.cursor, forward=True))
+
+        self.view = view
+        rows = self.get_rows(queryset, ordering, page_size + 1)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if after:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(before)
+
+        self.next_cursor = None
+        self.previous_cursor = None
+        if rows:
+            if has_next:
+                self.next_cursor = self.encode_cursor(rows[-1])
+            if has_previous:
+                self.previous_cursor = self.encode_cursor(rows[0])
+        elif after:
+            self.next_cursor = after
+        elif before:
+            self.previous_cursor = before
+
+        return rows
+
+    def get_rows(self, queryset, ordering, limit):
+        return list(queryset.order_by(*ordering)[:limit])
+
+    def get_paginated_response(self, data):
+        if self.legacy:
+            return self.legacy.get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ("next", self.get_link(self.before_query_param, self.next_cursor)),
+            ("previous", self.get_link(self.after_query_param, self.previous_cursor)),
+            ("results", data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_link(self, param, cursor):
+        if not cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.before_query_param)
+        url = remove_query_param(url, self.after_query_param)
+        return replace_query_param(url, param, cursor)
+
+    def reverse_ordering(self):
+        return tuple(field[1:] if field.startswith("-") else f"-{field}" for field in self.ordering)
+
+    def get_keyset_filter(self, values, forward):
+        query = None
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith("-")
+            lookup = "lt" if descending == forward else "gt"
+            condition = Q(**{f"{field.lstrip('-')}__{lookup}": values[index]})
+            for previous, value in zip(self.ordering[:index], values[:index]):
+                condition &= Q(**{previous.lstrip("-"): value})
+            query = condition if query is None else query | condition
+        return query
+
+    def get_value(self, row, field):
+        if isinstance(row, dict):
+            return row[field]
+        return getattr(row, field)
+
+    def encode_cursor(self, row):
+        values = [self.get_value(row, field.lstrip("-")) for field in self.ordering]
+        data = json.dumps(values, cls=CursorEncoder, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
@@ -0,0 +1,27 @@
+COMPACT = "compact"
+
+
+def get_representation(request, param="representation"):
+    """
+    The representation the client asked for, through the `representation`
+    query parameter or a profile on the accepted media type, e.g.
+    `Accept: application/json; profile="compact"`. None for the default one.
+    """
+    value = request.query_params.get(param, None)
+    if value:
+        return value
+
+    media_type = getattr(request, "accepted_media_type", None) or ""
+    for media_param in media_type.split(";")[1:]:
+        key, _, value = media_param.partition("=")
+        if key.strip() == "profile":
+            return value.strip().strip('"')
+    return None
+
+
+def get_sparse_fields(request, param="fields"):
+    # comma separated field names, None when every field is wanted
+    value = request.query_params.get(param, None)
+    if value is None:
+        return None
+    return [field.strip() for field in value.split(",") if field.strip()]
@@ -11,8 +11,9 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
 import os
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
@@ -37,6 +38,22 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 20,
 }
 
+# Authentication
+# With JWT_STATELESS_AUTH the access token claims are trusted as the request
+# principal and the CustomUser row is only loaded when a view needs it.
+JWT_STATELESS_AUTH = config("JWT_STATELESS_AUTH", default=True, cast=bool)
+JWT_ACCESS_TOKEN_LIFETIME = timedelta(minutes=5)
+JWT_VERIFIED_TOKEN_CACHE_SIZE = config(
+    "JWT_VERIFIED_TOKEN_CACHE_SIZE", default=10000, cast=int)
+
+# Presence
+# CustomUser.is_online is written behind: each user is recorded at most once
+# per PRESENCE_THROTTLE_SECONDS and flushed in bulk every
+# PRESENCE_FLUSH_INTERVAL seconds by a background thread (0 writes it in the
+# request instead).
+PRESENCE_THROTTLE_SECONDS = config("PRESENCE_THROTTLE_SECONDS", default=30, cast=int)
+PRESENCE_FLUSH_INTERVAL = config("PRESENCE_FLUSH_INTERVAL", default=10, cast=int)
+
 
 # Application definition
 
@@ -63,6 +80,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chatapi.db_router.ReadReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'chatapi.urls'
@@ -84,6 +102,22 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chatapi.wsgi.application'
+ASGI_APPLICATION = 'chatapi.asgi.application'
+
+# Realtime delivery over the /ws websocket of the ASGI application. Workers
+# of a multi-process deployment share events through the fan-out backend:
+# with message_control.realtime.UDPFanout each of the REALTIME_FANOUT_WORKERS
+# processes is started with its own REALTIME_WORKER_INDEX (0, 1, ...) and
+# listens on REALTIME_FANOUT_PORT + index.
+REALTIME_FANOUT = {
+    "BACKEND": config("REALTIME_FANOUT_BACKEND", default="message_control.realtime.InMemoryFanout"),
+    "OPTIONS": {
+        "host": config("REALTIME_FANOUT_HOST", default="127.0.0.1"),
+        "port": config("REALTIME_FANOUT_PORT", default=9001, cast=int),
+        "workers": config("REALTIME_FANOUT_WORKERS", default=1, cast=int),
+        "worker_index": config("REALTIME_WORKER_INDEX", default=0, cast=int),
+    },
+}
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_HEADERS = (
@@ -118,9 +152,64 @@ DATABASES = {
         'PASSWORD': DB_PASSWORD,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        # keep connections open between requests, 0 closes them after each one
+        'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=60, cast=int),
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica1.internal,replica2.internal.
+# Safe requests to views with `use_read_replica` read from them, see
+# chatapi/db_router.py.
+DATABASE_REPLICAS = []
+for index, host in enumerate(config("DB_REPLICA_HOSTS", default="", cast=Csv())):
+    alias = f"replica_{index}"
+    DATABASES[alias] = dict(DATABASES["default"], HOST=host, TEST={"MIRROR": "default"})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['chatapi.db_router.ReadReplicaRouter']
+# how long a user's reads stay on the primary after they wrote something
+REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", default=5, cast=int)
+
+
+# Cache
+# Use a shared backend (e.g. memcached) in production so token revocation,
+# favorites and unread counters are consistent across workers. The system
+# checks refuse a per-process default cache when WEB_CONCURRENCY worker
+# processes serve the API, see chatapi/checks.py.
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='chatapi'),
+    },
+    # UserProfileView list/search responses, see user_control/response_cache.py
+    'profiles': {
+        'BACKEND': config('PROFILE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('PROFILE_CACHE_LOCATION', default='profiles'),
+        'TIMEOUT': config('PROFILE_CACHE_TIMEOUT', default=30, cast=int),
+        'KEY_PREFIX': 'profiles',
+    },
+}
+PROFILE_CACHE_ENABLED = config("PROFILE_CACHE_ENABLED", default=True, cast=bool)
+
+# workers log their profile cache hit counters, `manage.py profile_cache_stats`
+# only sees them in a shared PROFILE_CACHE_BACKEND
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'user_control.response_cache': {'handlers': ['console'], 'level': 'INFO'}},
+}
+
+FAVORITES_CACHE_TIMEOUT = config("FAVORITES_CACHE_TIMEOUT", default=3600, cast=int)
+# Unread counters are cached for UNREAD_CACHE_TIMEOUT seconds, adjusted in
+# place and reset by `manage.py reconcile_unread`, only when the default
+# cache is shared (CACHE_BACKEND, e.g. memcached). With the LocMemCache
+# default they are counted from the message table on every read, since the
+# command could not reach the workers' copies.
+UNREAD_CACHE_TIMEOUT = config("UNREAD_CACHE_TIMEOUT", default=3600, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -188,4 +277,55 @@ AWS_S3_OBJECT_PARAMETERS = {
 
 DEFAULT_FILE_STORAGE = 'chatapi.storage_backends.MediaStorage'
 
-SOCKET_SERVER = config("SOCKET_SERVER")
+# Store uploads on the local filesystem instead of S3, e.g. offline deployments
+USE_LOCAL_STORAGE = config("USE_LOCAL_STORAGE", default=False, cast=bool)
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+if USE_LOCAL_STORAGE:
+    DEFAULT_FILE_STORAGE = 'chatapi.storage_backends.LocalMediaStorage'
+
+# Uploads are hashed while they are received so identical content is stored once
+FILE_UPLOAD_HANDLERS = [
+    'message_control.blobs.HashingMemoryFileUploadHandler',
+    'message_control.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# Image previews are rendered by THUMBNAIL_WORKERS background threads
+# (0 renders them when the upload's transaction commits)
+THUMBNAIL_SIZE = config("THUMBNAIL_SIZE", default=320, cast=int)
+THUMBNAIL_QUALITY = config("THUMBNAIL_QUALITY", default=80, cast=int)
+THUMBNAIL_WORKERS = config("THUMBNAIL_WORKERS", default=2, cast=int)
+
+# Chunked uploads, parts are spooled to disk above UPLOAD_SPOOL_MAX_SIZE bytes
+UPLOAD_PART_SIZE = config("UPLOAD_PART_SIZE", default=8 * 1024 * 1024, cast=int)
+UPLOAD_MAX_PART_SIZE = config("UPLOAD_MAX_PART_SIZE", default=64 * 1024 * 1024, cast=int)
+UPLOAD_SPOOL_MAX_SIZE = 1024 * 1024
+
+# Direct-to-storage uploads and downloads
+PRESIGNED_URL_EXPIRY = config("PRESIGNED_URL_EXPIRY", default=900, cast=int)
+PRESIGNED_CONFIRM_MAX_AGE = 24 * 60 * 60
+
+# Sync tokens older than this are refused and older changes pruned by
+# `manage.py prune_changes`
+SYNC_RETENTION_DAYS = config("SYNC_RETENTION_DAYS", default=30, cast=int)
+# Sync only serves changes older than this, it has to be longer than any
+# write transaction so a change committed late is never skipped
+SYNC_SETTLE_SECONDS = config("SYNC_SETTLE_SECONDS", default=10, cast=int)
+
+# Months of messages kept in the message table, older ones are moved to
+# archive files by `manage.py archive_messages`
+MESSAGE_ARCHIVE_AFTER_MONTHS = config("MESSAGE_ARCHIVE_AFTER_MONTHS", default=12, cast=int)
+
+# Hand-written serializers for the message and profile listings, same
+# output as the DRF ones (see chatapi/fast_serializers.py)
+FAST_SERIALIZERS_ENABLED = config("FAST_SERIALIZERS_ENABLED", default=True, cast=bool)
+
+MESSAGE_BULK_MAX_SIZE = config("MESSAGE_BULK_MAX_SIZE", default=500, cast=int)
+
+# Socket notifications are posted from a background thread, one event per
+# request. With SOCKET_BATCH_SIZE above 1 queued events are sent together as
+# {"version": 2, "events": [...]}, the socket server has to accept that format.
+SOCKET_SERVER = config("SOCKET_SERVER", default="")
+SOCKET_TIMEOUT = config("SOCKET_TIMEOUT", default=3.0, cast=float)
+SOCKET_QUEUE_SIZE = config("SOCKET_QUEUE_SIZE", default=10000, cast=int)
+SOCKET_BATCH_SIZE = config("SOCKET_BATCH_SIZE", default=1, cast=int)
+SOCKET_MAX_RETRIES = config("SOCKET_MAX_RETRIES", default=3, cast=int)
@@ -1,6 +1,154 @@
+import base64
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
 from storages.backends.s3boto3 import S3Boto3Storage
 
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def get_sha256_checksum(sha256):
+    # hex digest to the base64 form of x-amz-checksum-sha256
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+
+class ChecksumMismatch(Exception):
+    pass
+
 
 class MediaStorage(S3Boto3Storage):
     location = 'media'
     file_overwrite = False
+
+    @property
+    def client(self):
+        return self.connection.meta.client
+
+    def get_key(self, name):
+        return self._normalize_name(self._clean_name(name))
+
+    def create_multipart_upload(self, name, content_type=None):
+        params = {"Bucket": self.bucket_name, "Key": self.get_key(name)}
+        if content_type:
+            params["ContentType"] = content_type
+        return self.client.create_multipart_upload(**params)["UploadId"]
+
+    def upload_part(self, name, upload_id, part_number, content):
+        response = self.client.upload_part(
+            Bucket=self.bucket_name, Key=self.get_key(name), UploadId=upload_id,
+            PartNumber=part_number, Body=content)
+        return response["ETag"]
+
+    def complete_multipart_upload(self, name, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.get_key(name), UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"PartNumber": part_number, "ETag": etag} for part_number, etag in parts]})
+        return name
+
+    def abort_multipart_upload(self, name, upload_id):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.get_key(name), UploadId=upload_id)
+
+    def get_presigned_upload_url(self, name, expires_in, content_type=None, sha256=None):
+        """
+        With sha256, S3 rejects a PUT whose content does not match it (the
+        client sends it as x-amz-checksum-sha256).
+        """
+        params = {"Bucket": self.bucket_name, "Key": self.get_key(name)}
+        if content_type:
+            params["ContentType"] = content_type
+        if sha256:
+            params["ChecksumSHA256"] = get_sha256_checksum(sha256)
+        return self.client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires_in)
+
+    def get_presigned_download_url(self, name, expires_in):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket_name, "Key": self.get_key(name)}, ExpiresIn=expires_in)
+
+
+class LocalMediaStorage(FileSystemStorage):
+    """
+    Filesystem storage with the same multipart upload and presigned URL API
+    as MediaStorage, for tests and offline deployments. Parts are kept under
+    .multipart/ and concatenated into the final file on completion, presigned
+    URLs point to a signed endpoint of this API.
+    """
+    multipart_directory = ".multipart"
+    signing_salt = "chatapi.storage_backends.LocalMediaStorage"
+
+    def get_parts_path(self, upload_id):
+        return self.path(os.path.join(self.multipart_directory, upload_id))
+
+    def create_multipart_upload(self, name, content_type=None):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.get_parts_path(upload_id))
+        return upload_id
+
+    def upload_part(self, name, upload_id, part_number, content):
+        digest = hashlib.md5()
+        with open(os.path.join(self.get_parts_path(upload_id), str(part_number)), "wb") as part:
+            for chunk in iter(lambda: content.read(COPY_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                part.write(chunk)
+        return digest.hexdigest()
+
+    def complete_multipart_upload(self, name, upload_id, parts):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        parts_path = self.get_parts_path(upload_id)
+        with open(path, "wb") as destination:
+            for part_number, _ in parts:
+                with open(os.path.join(parts_path, str(part_number)), "rb") as part:
+                    shutil.copyfileobj(part, destination, COPY_CHUNK_SIZE)
+        shutil.rmtree(parts_path, ignore_errors=True)
+        return name
+
+    def abort_multipart_upload(self, name, upload_id):
+        shutil.rmtree(self.get_parts_path(upload_id), ignore_errors=True)
+
+    def get_signed_url(self, name, method, expires_in, sha256=None):
+        token = signing.dumps({"name": name, "method": method, "expires_at": int(time.time()) + expires_in,
+                               "sha256": sha256}, salt=self.signing_salt)
+        return reverse("local-storage", kwargs={"token": token})
+
+    def get_presigned_upload_url(self, name, expires_in, content_type=None, sha256=None):
+        return self.get_signed_url(name, "PUT", expires_in, sha256)
+
+    def get_presigned_download_url(self, name, expires_in):
+        return self.get_signed_url(name, "GET", expires_in)
+
+    def verify_signed_url(self, token, method):
+        """
+        Returns what a signed URL grants `method` on, the file name and
+        the sha256 its content must have, or None.
+        """
+        try:
+            data = signing.loads(token, salt=self.signing_salt)
+        except signing.BadSignature:
+            return None
+        if data.get("method") != method or time.time() > data.get("expires_at", 0):
+            return None
+        return data
+
+    def write_stream(self, name, stream, sha256=None):
+        """
+        Writes stream to name, like S3 a checksum mismatch raises
+        ChecksumMismatch and stores nothing.
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        with open(path, "wb") as destination:
+            for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                destination.write(chunk)
+        if sha256 and digest.hexdigest() != sha256:
+            os.remove(path)
+            raise ChecksumMismatch()
+        return name
@@ -0,0 +1,194 @@
+import gzip
+import json
+import tempfile
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from chatapi.pagination import KeysetPagination
+from .conversations import refresh_unread, split_key
+from .models import GenericFileUpload, Message, MessageArchive, MessageAttachment
+
+ARCHIVE_DIRECTORY = "archive/messages"
+
+
+def get_month_start(value, months_back=0):
+    year, month = value.year, value.month - months_back
+    while month <= 0:
+        month += 12
+        year -= 1
+    return value.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def get_segment_name(conversation_key, month):
+    return f"{ARCHIVE_DIRECTORY}/{month:%Y-%m}/{conversation_key.replace(':', '-')}.jsonl.gz"
+
+
+def get_sort_key(row):
+    return row["created_at"], row["id"]
+
+
+def dump_message(message):
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "message": message.message,
+        "is_read": message.is_read,
+        "conversation_key": message.conversation_key,
+        "created_at": message.created_at,
+        "updated_at": message.updated_at,
+        "attachments": [{
+            "id": attachment.id,
+            "attachment_id": attachment.attachment_id,
+            "caption": attachment.caption,
+            "created_at": attachment.created_at,
+        } for attachment in message.message_attachments.all()],
+    }
+
+
+def read_segment(name):
+    with default_storage.open(name, "rb") as file, gzip.GzipFile(fileobj=file) as archive:
+        for line in archive:
+            row = json.loads(line)
+            row["created_at"] = parse_datetime(row["created_at"])
+            yield row
+
+
+def write_segment(name, rows):
+    """
+    Streams rows into a gzipped JSON lines file, replacing name, and
+    returns (name, row count, first and last created_at).
+    """
+    count, first, last = 0, None, None
+    with tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_SIZE) as buffer:
+        with gzip.GzipFile(fileobj=buffer, mode="wb") as archive:
+            for row in rows:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b"\n")
+                count += 1
+                first = first or row["created_at"]
+                last = row["created_at"]
+        buffer.seek(0)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        name = default_storage.save(name, File(buffer, name=name))
+    return name, count, first, last
+
+
+def iter_messages(messages, batch_size):
+    ids = list(messages.order_by("created_at", "id").values_list("id", flat=True))
+    for start in range(0, len(ids), batch_size):
+        batch = Message.objects.filter(id__in=ids[start:start + batch_size]).prefetch_related(
+            "message_attachments").order_by("created_at", "id")
+        for message in batch:
+            yield dump_message(message)
+
+
+def archive_segment(conversation_key, month, batch_size=1000):
+    """
+    Moves one month of a conversation into its archive file, merging with
+    a file left by an earlier run, then deletes the rows from the table.
+    Their search index rows go with them, archived messages are listed but
+    not searched.
+    """
+    messages = Message.objects.filter(
+        conversation_key=conversation_key, created_at__gte=month, created_at__lt=get_next_month(month))
+    rows = iter_messages(messages, batch_size)
+
+    existing = MessageArchive.objects.filter(conversation_key=conversation_key, month=month).first()
+    if existing:
+        merged = {row["id"]: row for row in read_segment(existing.file.name)}
+        for row in rows:
+            merged[row["id"]] = row
+        rows = sorted(merged.values(), key=get_sort_key)
+
+    ids = list(messages.values_list("id", flat=True))
+    name, count, first, last = write_segment(get_segment_name(conversation_key, month), rows)
+    with transaction.atomic():
+        MessageArchive.objects.update_or_create(
+            conversation_key=conversation_key, month=month, defaults={
+                "file": name, "message_count": count, "first_created_at": first, "last_created_at": last})
+        for start in range(0, len(ids), batch_size):
+            Message.objects.filter(id__in=ids[start:start + batch_size]).delete()
+    refresh_unread([conversation_key])
+    return len(ids)
+
+
+def load_messages(conversation_key, rows):
+    """
+    Unsaved Message instances for archived rows, with their users and
+    attachments attached so MessageSerializer needs no further queries.
+    """
+    users = get_user_model().objects.select_related("user_profile__profile_picture__blob").prefetch_related(
+        "groups", "user_permissions").in_bulk(split_key(conversation_key))
+    upload_ids = {attachment["attachment_id"] for row in rows for attachment in row["attachments"]}
+    uploads = GenericFileUpload.objects.select_related("blob").in_bulk(upload_ids)
+
+    messages = []
+    for row in rows:
+        message = Message(
+            id=row["id"], sender_id=row["sender_id"], receiver_id=row["receiver_id"], message=row["message"],
+            is_read=row["is_read"], conversation_key=row["conversation_key"], created_at=row["created_at"],
+            updated_at=parse_datetime(row["updated_at"]))
+        message.sender = users.get(row["sender_id"])
+        message.receiver = users.get(row["receiver_id"])
+        message._prefetched_objects_cache = {"message_attachments": [
+            # segments written before attachment ids were kept have none
+            MessageAttachment(id=attachment.get("id"), message=message,
+                              attachment=uploads[attachment["attachment_id"]], caption=attachment["caption"],
+                              created_at=parse_datetime(attachment["created_at"]))
+            for attachment in row["attachments"] if attachment["attachment_id"] in uploads
+        ]}
+        messages.append(message)
+    return messages
+
+
+def get_archived_messages(conversation_key, cursor, older, limit):
+    """
+    Up to limit archived messages past cursor, [created_at, id], walking
+    back in time when older is set and forward otherwise.
+    """
+    cursor = (parse_datetime(cursor[0]), cursor[1]) if cursor else None
+    archives = MessageArchive.objects.filter(conversation_key=conversation_key)
+    if cursor and older:
+        archives = archives.filter(first_created_at__lte=cursor[0])
+    elif cursor:
+        archives = archives.filter(last_created_at__gte=cursor[0])
+
+    rows = []
+    for archive in archives.order_by("-month" if older else "month"):
+        for row in sorted(read_segment(archive.file.name), key=get_sort_key, reverse=older):
+            if cursor and (get_sort_key(row) >= cursor if older else get_sort_key(row) <= cursor):
+                continue
+            rows.append(row)
+            if len(rows) >= limit:
+                return load_messages(conversation_key, rows)
+    return load_messages(conversation_key, rows) if rows else []
+
+
+class ArchivedMessagePagination(KeysetPagination):
+    """
+    Keyset pagination over a conversation that continues into its archive
+    once the message table has no older rows.
+    """
+
+    def get_rows(self, queryset, ordering, limit):
+        rows = super().get_rows(queryset, ordering, limit)
+        conversation_key = self.view.get_archive_key() if self.view else None
+        if not conversation_key or (self.forward and len(rows) >= limit):
+            return rows
+
+        archived = get_archived_messages(conversation_key, self.cursor, self.forward, limit)
+        if not archived:
+            return rows
+        rows = sorted(rows + archived, key=lambda message: (message.created_at, message.id), reverse=self.forward)
+        return rows[:limit]
@@ -0,0 +1,148 @@
+import hashlib
+import os
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import GenericFileUpload, StoredBlob
+from .thumbnails import is_image, schedule_thumbnail
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class HashingUploadHandlerMixin:
+    """
+    Hashes uploaded files while they are received, the digest is set on
+    the resulting file as `sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # set first, new_file of the handler taking the file raises StopFutureHandlers
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        result = super().receive_data_chunk(raw_data, start)
+        # None means this handler consumed the chunk
+        if result is None:
+            self.hasher.update(raw_data)
+        return result
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def get_content_hash(file):
+    sha256 = getattr(file, "sha256", None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def get_stored_hash(name):
+    hasher = hashlib.sha256()
+    with default_storage.open(name, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_blob_name(sha256, file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    return f"blobs/{sha256[:2]}/{sha256}{extension}"
+
+
+def acquire_blob(sha256, size=None):
+    """
+    Takes a reference on the blob holding this content, returns None when
+    there is none yet.
+    """
+    blobs = StoredBlob.objects.filter(sha256=sha256)
+    if size is not None:
+        blobs = blobs.filter(size=size)
+    if not blobs.update(ref_count=F("ref_count") + 1):
+        return None
+    return StoredBlob.objects.get(sha256=sha256)
+
+
+def add_blob(sha256, name, size):
+    """
+    Registers a file already in storage as the blob for sha256. If another
+    request registered the same content first the file is deleted and that
+    blob is used instead.
+    """
+    try:
+        with transaction.atomic():
+            return StoredBlob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+    except IntegrityError:
+        default_storage.delete(name)
+        return acquire_blob(sha256)
+
+
+def release_blob(blob_id):
+    with transaction.atomic():
+        StoredBlob.objects.filter(id=blob_id).update(ref_count=F("ref_count") - 1)
+        blob = StoredBlob.objects.select_for_update().filter(id=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        blob.delete()
+        for name in (blob.file.name, blob.thumbnail.name):
+            if name:
+                transaction.on_commit(lambda name=name: default_storage.delete(name))
+
+
+def create_upload(blob, content_type=""):
+    if not blob.thumbnail and is_image(content_type, blob.file.name):
+        schedule_thumbnail(blob.id)
+    return GenericFileUpload.objects.create(
+        file_upload=blob.file.name, blob=blob, size=blob.size, content_type=content_type)
+
+
+def store_file(file, content_type=""):
+    """
+    Stores an uploaded file unless its content is already stored, and
+    returns a new upload pointing to the blob.
+    """
+    sha256 = get_content_hash(file)
+    with transaction.atomic():
+        blob = acquire_blob(sha256)
+        if blob is None:
+            name = default_storage.save(get_blob_name(sha256, file.name), file)
+            blob = add_blob(sha256, name, file.size)
+        return create_upload(blob, content_type)
+
+
+def register_stored_file(name, content_type="", sha256=None):
+    """
+    Turns a file written straight to storage (presigned or chunked upload)
+    into an upload without reading it back. With a sha256 the storage
+    verified on upload, a known content drops the new copy. Otherwise the
+    upload gets no blob yet, `dedupe_uploads` hashes it in the background.
+    """
+    size = default_storage.size(name)
+    if not sha256:
+        return GenericFileUpload.objects.create(file_upload=name, size=size, content_type=content_type)
+
+    with transaction.atomic():
+        blob = acquire_blob(sha256)
+        if blob is None:
+            blob = add_blob(sha256, name, size)
+        upload = create_upload(blob, content_type)
+    if blob.file.name != name:
+        default_storage.delete(name)
+    return upload
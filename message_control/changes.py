@@ -0,0 +1,32 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Change
+
+
+def log_message_changes(messages, deleted=False):
+    """
+    Adds the messages to the change feed of both participants. Deleted
+    messages are logged as tombstones.
+    """
+    Change.objects.bulk_create([
+        Change(user_id=user_id, kind=Change.MESSAGE, object_id=message.id, deleted=deleted)
+        for message in messages
+        for user_id in (message.sender_id, message.receiver_id)
+    ])
+
+
+def log_read(reader_id, sender_id, conversation_key, up_to_id=None, up_to=None):
+    data = {
+        "reader": reader_id,
+        "conversation_key": conversation_key,
+        "up_to_id": up_to_id,
+        "up_to": DjangoJSONEncoder().default(up_to) if up_to else None,
+    }
+    Change.objects.bulk_create([
+        Change(user_id=user_id, kind=Change.READ, object_id=reader_id, data=data)
+        for user_id in (reader_id, sender_id)
+    ])
+
+
+def log_profile_change(profile_id, deleted=False):
+    # profiles are listed to everyone, so they go to the shared feed
+    Change.objects.create(user=None, kind=Change.PROFILE, object_id=profile_id, deleted=deleted)
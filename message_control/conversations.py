@@ -0,0 +1,119 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .models import Conversation, Message
+from .unread import add_unread, set_pair_counts
+
+PREVIEW_LENGTH = 255
+
+
+def split_key(conversation_key):
+    first_user_id, second_user_id = conversation_key.split(":")
+    return int(first_user_id), int(second_user_id)
+
+
+def get_unread_field(conversation_key, receiver_id):
+    first_user_id, _ = split_key(conversation_key)
+    if int(receiver_id) == first_user_id:
+        return "first_user_unread"
+    return "second_user_unread"
+
+
+def get_preview(message):
+    if not message:
+        return ""
+    return (message.message or "")[:PREVIEW_LENGTH]
+
+
+def save_conversation(conversation_key, fields, defaults=None):
+    fields["updated_at"] = timezone.now()
+    if Conversation.objects.filter(key=conversation_key).update(**fields):
+        return
+
+    first_user_id, second_user_id = split_key(conversation_key)
+    defaults = defaults if defaults is not None else fields
+    try:
+        with transaction.atomic():
+            Conversation.objects.create(
+                key=conversation_key, first_user_id=first_user_id, second_user_id=second_user_id, **defaults)
+    except IntegrityError:
+        # created concurrently by another request
+        Conversation.objects.filter(key=conversation_key).update(**fields)
+
+
+def record_message(message):
+    record_messages([message])
+
+
+def record_messages(messages):
+    """
+    Moves newly created messages to the top of their conversations and bumps
+    the receivers' unread counters, one UPDATE per conversation.
+    """
+    conversations = {}
+    for message in messages:
+        conversations.setdefault(message.conversation_key, []).append(message)
+
+    for conversation_key, conversation_messages in conversations.items():
+        last_message = max(conversation_messages, key=lambda message: (message.created_at, message.id))
+        fields = {
+            "last_message": last_message,
+            "last_message_preview": get_preview(last_message),
+            "last_message_at": last_message.created_at,
+        }
+        defaults = dict(fields)
+        unread = {}
+        for message in conversation_messages:
+            if message.is_read:
+                continue
+            unread_field = get_unread_field(conversation_key, message.receiver_id)
+            defaults[unread_field] = defaults.get(unread_field, 0) + 1
+            pair = (message.receiver_id, message.sender_id)
+            unread[pair] = unread.get(pair, 0) + 1
+        for unread_field in ("first_user_unread", "second_user_unread"):
+            if unread_field in defaults:
+                fields[unread_field] = F(unread_field) + defaults[unread_field]
+        save_conversation(conversation_key, fields, defaults)
+        for (receiver_id, sender_id), count in unread.items():
+            add_unread(receiver_id, sender_id, count)
+
+
+def refresh_conversations(conversation_keys):
+    """
+    Recomputes the last message and unread counters of the given
+    conversations, used after edits, deletions and read receipts. The
+    cached unread counters are reset to the recomputed values.
+    """
+    refresh_unread(conversation_keys, last_message=True)
+
+
+def refresh_unread(conversation_keys, last_message=False):
+    """
+    Recomputes the unread counters, and the last message when asked. The
+    archive keeps the summary of conversations whose messages it moved out.
+    """
+    unread_counts = {}
+    for conversation_key in set(conversation_keys):
+        if not conversation_key:
+            continue
+        first_user_id, second_user_id = split_key(conversation_key)
+        unread_counts[first_user_id, second_user_id] = 0
+        unread_counts[second_user_id, first_user_id] = 0
+
+        messages = Message.objects.filter(conversation_key=conversation_key)
+        fields = {"first_user_unread": 0, "second_user_unread": 0}
+        if last_message:
+            message = messages.order_by("-created_at", "-id").first()
+            fields.update({
+                "last_message": message,
+                "last_message_preview": get_preview(message),
+                "last_message_at": message.created_at if message else None,
+            })
+        unread = messages.filter(is_read=False).values(
+            "receiver_id").annotate(count=Count("id")).order_by()
+        for row in unread:
+            fields[get_unread_field(conversation_key, row["receiver_id"])] = row["count"]
+            sender_id = second_user_id if row["receiver_id"] == first_user_id else first_user_id
+            unread_counts[row["receiver_id"], sender_id] = row["count"]
+        save_conversation(conversation_key, fields)
+    set_pair_counts(unread_counts)
@@ -0,0 +1,73 @@
+from chatapi.fast_serializers import (
+    FastSerializer, attribute, datetime_attribute, file_attribute, format_file, method, nested
+)
+from .serializers import get_viewer_id
+from .unread import get_unread_counts
+
+
+class FastGenericFileUploadSerializer(FastSerializer):
+    field_accessors = (
+        ("id", attribute("id")),
+        ("thumbnail", method("get_thumbnail")),
+        ("file_upload", file_attribute("file_upload")),
+        ("size", attribute("size")),
+        ("content_type", attribute("content_type")),
+        ("created_at", datetime_attribute("created_at")),
+        ("blob", attribute("blob_id")),
+    )
+
+    def get_thumbnail(self, obj):
+        if not obj.blob_id:
+            return None
+        return format_file(obj.blob.thumbnail, self.context)
+
+
+class FastMessageAttachmentSerializer(FastSerializer):
+    field_accessors = (
+        ("id", attribute("id")),
+        ("attachment", nested("attachment", FastGenericFileUploadSerializer)),
+        ("caption", attribute("caption")),
+        ("created_at", datetime_attribute("created_at")),
+        ("message", attribute("message_id")),
+    )
+
+
+class FastMessageSerializer(FastSerializer):
+    """
+    MessageSerializer's read output, for the message listing.
+    """
+    field_accessors = (
+        ("id", attribute("id")),
+        ("sender", method("get_sender_data")),
+        ("receiver", method("get_receiver_data")),
+        ("message_attachments", nested("message_attachments", FastMessageAttachmentSerializer, many=True)),
+        ("message", attribute("message")),
+        ("is_read", attribute("is_read")),
+        ("conversation_key", attribute("conversation_key")),
+        ("created_at", datetime_attribute("created_at")),
+        ("updated_at", datetime_attribute("updated_at")),
+    )
+
+    def to_representation_many(self, messages):
+        if {"sender", "receiver"} & set(self.field_names):
+            user_ids = set()
+            for message in messages:
+                user_ids.update((message.sender_id, message.receiver_id))
+            self.context["unread_counts"] = get_unread_counts(get_viewer_id(self.context), user_ids)
+        return super().to_representation_many(messages)
+
+    def to_representation(self, instance):
+        if "unread_counts" not in self.context:
+            self.context["unread_counts"] = get_unread_counts(
+                get_viewer_id(self.context), (instance.sender_id, instance.receiver_id))
+        return super().to_representation(instance)
+
+    def get_profile_data(self, user):
+        from user_control.fast_serializers import FastUserProfileSerializer
+        return self.get_child(FastUserProfileSerializer).to_representation(user.user_profile)
+
+    def get_sender_data(self, obj):
+        return self.get_profile_data(obj.sender)
+
+    def get_receiver_data(self, obj):
+        return self.get_profile_data(obj.receiver)
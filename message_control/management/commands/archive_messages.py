@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from message_control.archive import archive_segment, get_month_start
+from message_control.models import Message
+
+
+class Command(BaseCommand):
+    help = "Moves messages older than MESSAGE_ARCHIVE_AFTER_MONTHS to monthly archive files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        months = options["months"] if options["months"] is not None else settings.MESSAGE_ARCHIVE_AFTER_MONTHS
+        cutoff = get_month_start(timezone.now(), months)
+
+        segments = Message.objects.filter(created_at__lt=cutoff).annotate(
+            month=TruncMonth("created_at")).values_list("conversation_key", "month").distinct().order_by(
+            "month", "conversation_key")
+
+        total = count = 0
+        for conversation_key, month in list(segments):
+            total += archive_segment(conversation_key, month, options["batch_size"])
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} messages into {count} segments"))
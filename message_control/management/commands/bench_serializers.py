@@ -0,0 +1,75 @@
+import timeit
+from django.contrib.auth.models import Group, Permission
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from message_control.fast_serializers import FastMessageSerializer
+from message_control.models import GenericFileUpload, Message, MessageAttachment, StoredBlob
+from message_control.serializers import MessageSerializer
+from user_control.fast_serializers import FastUserProfileSerializer
+from user_control.models import CustomUser, UserProfile
+from user_control.serializers import UserProfileSerializer
+
+
+def build_upload(upload_id, storage, now):
+    blob = StoredBlob(id=upload_id, sha256=f"{upload_id:064x}", file=f"blobs/{upload_id}.png",
+                      thumbnail=f"blobs/{upload_id}.thumb.webp", size=2048, ref_count=1, created_at=now)
+    upload = GenericFileUpload(id=upload_id, file_upload=f"uploads/{upload_id}.png", blob=blob, size=2048,
+                               content_type="image/png", created_at=now)
+    upload.file_upload.storage = storage
+    blob.thumbnail.storage = storage
+    return upload
+
+
+def build_page(page_size):
+    """
+    A page of unsaved messages between two users and a page of profiles,
+    with everything the serializers read already attached, so the timings
+    run no queries.
+    """
+    storage = FileSystemStorage(base_url="/media/")
+    now = timezone.now()
+
+    profiles = []
+    for index in range(1, page_size + 1):
+        user = CustomUser(id=index, username=f"user{index}", email=f"user{index}@example.com",
+                          created_at=now, updated_at=now, is_online=now, last_login=now)
+        user._prefetched_objects_cache = {"groups": Group.objects.none(), "user_permissions": Permission.objects.none()}
+        user.user_profile = UserProfile(
+            id=index, user=user, first_name=f"First {index}", last_name=f"Last {index}", caption="caption",
+            about="about", profile_picture=build_upload(index, storage, now), search_document=f"user{index}",
+            created_at=now, updated_at=now)
+        profiles.append(user.user_profile)
+
+    sender, receiver = profiles[0].user, profiles[-1].user
+    messages = []
+    for index in range(1, page_size + 1):
+        message = Message(id=index, sender=sender, receiver=receiver, message=f"message {index}",
+                          conversation_key=Message.get_conversation_key(sender.id, receiver.id),
+                          created_at=now, updated_at=now)
+        message._prefetched_objects_cache = {"message_attachments": [
+            MessageAttachment(id=index, message=message, attachment=build_upload(page_size + index, storage, now),
+                              caption="attachment", created_at=now)
+        ] if index % 2 else []}
+        messages.append(message)
+    return messages, profiles
+
+
+class Command(BaseCommand):
+    help = "Times the DRF and the fast serializers on in-memory pages of messages and profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--rounds", type=int, default=200)
+
+    def handle(self, *args, **options):
+        messages, profiles = build_page(options["page_size"])
+        rounds = options["rounds"]
+
+        for name, rows, slow, fast in (("messages", messages, MessageSerializer, FastMessageSerializer),
+                                       ("profiles", profiles, UserProfileSerializer, FastUserProfileSerializer)):
+            timings = [timeit.timeit(lambda: serializer(rows, many=True, context={}).data, number=rounds) / rounds
+                       for serializer in (slow, fast)]
+            self.stdout.write(
+                f"{name}: drf {timings[0] * 1000:.2f} ms, fast {timings[1] * 1000:.2f} ms "
+                f"per page of {len(rows)} ({timings[0] / timings[1]:.1f}x)")
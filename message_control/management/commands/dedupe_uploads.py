@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from message_control.blobs import acquire_blob, add_blob, get_stored_hash
+from message_control.models import GenericFileUpload
+from django.core.files.storage import default_storage
+
+
+class Command(BaseCommand):
+    help = "Points uploads stored before deduplication to shared blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        uploads = GenericFileUpload.objects.filter(blob__isnull=True).order_by("id")
+
+        linked = missing = 0
+        for upload in uploads.iterator(chunk_size=options["chunk_size"]):
+            name = upload.file_upload.name
+            if not name or not default_storage.exists(name):
+                missing += 1
+                continue
+
+            sha256 = get_stored_hash(name)
+            with transaction.atomic():
+                blob = acquire_blob(sha256)
+                if blob is None:
+                    blob = add_blob(sha256, name, default_storage.size(name))
+                GenericFileUpload.objects.filter(id=upload.id).update(
+                    blob=blob, file_upload=blob.file.name, size=blob.size)
+            if blob.file.name != name:
+                default_storage.delete(name)
+            linked += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} uploads, {missing} files missing"))
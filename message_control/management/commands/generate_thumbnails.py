@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from message_control.models import GenericFileUpload, StoredBlob
+from message_control.thumbnails import generate_thumbnail, is_image
+
+
+class Command(BaseCommand):
+    help = "Renders the missing thumbnails of stored images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        image_uploads = GenericFileUpload.objects.filter(blob=OuterRef("pk"), content_type__startswith="image/")
+        blobs = StoredBlob.objects.filter(thumbnail="").annotate(
+            has_image_upload=Exists(image_uploads)).order_by("id")
+
+        rendered = skipped = 0
+        for blob in blobs.iterator(chunk_size=options["chunk_size"]):
+            if not blob.has_image_upload and not is_image("", blob.file.name):
+                continue
+            if generate_thumbnail(blob.id):
+                rendered += 1
+            else:
+                skipped += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} thumbnails, {skipped} files are not images"))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from message_control.models import Change
+
+
+class Command(BaseCommand):
+    help = "Deletes sync changes older than SYNC_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=settings.SYNC_RETENTION_DAYS)
+        changes = Change.objects.filter(created_at__lt=cutoff)
+
+        total = 0
+        while True:
+            ids = list(changes.order_by("id").values_list("id", flat=True)[:options["chunk_size"]])
+            if not ids:
+                break
+            total += Change.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Pruned {total} changes"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from message_control.conversations import refresh_conversations
+from message_control.models import Message
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the conversation summaries from the message table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        conversation_keys = Message.objects.exclude(conversation_key__isnull=True).values_list(
+            "conversation_key", flat=True).distinct().order_by("conversation_key")
+
+        chunk = []
+        total = 0
+        for conversation_key in conversation_keys.iterator(chunk_size=chunk_size):
+            chunk.append(conversation_key)
+            if len(chunk) >= chunk_size:
+                refresh_conversations(chunk)
+                total += len(chunk)
+                chunk = []
+        refresh_conversations(chunk)
+        total += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} conversations"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from message_control.conversations import refresh_conversations
+from message_control.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "Recounts the unread counters of conversations with unread messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        conversation_keys = set(Message.objects.filter(is_read=False).exclude(
+            conversation_key__isnull=True).values_list("conversation_key", flat=True).distinct())
+        # counters that are stale in the other direction
+        conversation_keys.update(Conversation.objects.filter(
+            Q(first_user_unread__gt=0) | Q(second_user_unread__gt=0)).values_list("key", flat=True))
+
+        conversation_keys = sorted(conversation_keys)
+        for start in range(0, len(conversation_keys), chunk_size):
+            refresh_conversations(conversation_keys[start:start + chunk_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(conversation_keys)} conversations"))
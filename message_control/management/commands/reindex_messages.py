@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from message_control.models import Message
+from message_control.search import index_messages, uses_tsvector
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the message search index from the message table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if uses_tsvector():
+            self.stdout.write(self.style.SUCCESS("PostgreSQL maintains the search index itself"))
+            return
+
+        chunk_size = options["chunk_size"]
+        messages = Message.objects.only("id", "message").order_by("id")
+
+        last_id = total = 0
+        while True:
+            chunk = list(messages.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            index_messages(chunk)
+            total += len(chunk)
+            last_id = chunk[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} messages"))
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import Max, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+BATCH_SIZE = 5000
+
+
+def backfill_conversation_key(apps, schema_editor):
+    # each batch is its own short UPDATE so the table is never locked as a whole
+    Message = apps.get_model('message_control', 'Message')
+    messages = Message.objects.using(schema_editor.connection.alias)
+
+    conversation_key = Concat(
+        Cast(Least('sender_id', 'receiver_id'), models.CharField()),
+        Value(':'),
+        Cast(Greatest('sender_id', 'receiver_id'), models.CharField()),
+        output_field=models.CharField(),
+    )
+    last_id = messages.aggregate(last_id=Max('id'))['last_id'] or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        messages.filter(
+            id__gt=start, id__lte=start + BATCH_SIZE, conversation_key__isnull=True
+        ).update(conversation_key=conversation_key)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('message_control', '0003_message_conversation_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_conversation_key, migrations.RunPython.noop),
+    ]
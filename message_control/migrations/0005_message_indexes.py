@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+INDEXES = [
+    models.Index(fields=['conversation_key', 'created_at', 'id'], name='message_conversation_idx'),
+    models.Index(fields=['receiver', 'sender', 'is_read'], name='message_unread_idx'),
+]
+
+
+def get_options(schema_editor):
+    # PostgreSQL builds them without locking writes to the message table
+    return {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+
+
+def add_indexes(apps, schema_editor):
+    Message = apps.get_model('message_control', 'Message')
+    for index in INDEXES:
+        schema_editor.add_index(Message, index, **get_options(schema_editor))
+
+
+def remove_indexes(apps, schema_editor):
+    Message = apps.get_model('message_control', 'Message')
+    for index in INDEXES:
+        schema_editor.remove_index(Message, index, **get_options(schema_editor))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('message_control', '0004_backfill_conversation_key'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_indexes, remove_indexes)],
+            state_operations=[migrations.AddIndex(model_name='message', index=index) for index in INDEXES],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1 on 2026-10-18 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message_control', '0005_message_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('first_user_unread', models.PositiveIntegerField(default=0)),
+                ('second_user_unread', models.PositiveIntegerField(default=0)),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=255)),
+                ('last_message_at', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('first_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='first_user_conversations', to=settings.AUTH_USER_MODEL)),
+                ('last_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='message_control.message')),
+                ('second_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='second_user_conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-last_message_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['first_user', 'last_message_at', 'id'], name='conversation_first_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['second_user', 'last_message_at', 'id'], name='conversation_second_user_idx'),
+        ),
+    ]
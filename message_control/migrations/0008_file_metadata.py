@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_control', '0007_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='content_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_control', '0009_stored_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='thumbnail',
+            field=models.FileField(blank=True, default='', upload_to=''),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # same expression as message_control.search.TSVECTOR_TEMPLATE
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS message_search_vector_idx ON message_control_message "
+        "USING gin (to_tsvector('simple'::regconfig, COALESCE(message, '')))")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS message_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('message_control', '0011_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveSmallIntegerField(default=1)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='message_control.message')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messagesearchterm',
+            index=models.Index(fields=['term', 'message'], name='message_search_term_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
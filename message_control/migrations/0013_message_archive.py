@@ -0,0 +1,48 @@
+# Generated by Django 3.1 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+def create_created_at_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # a few pages per month of rows, lets the archive command find old months cheaply
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS message_created_at_brin_idx ON message_control_message '
+        'USING brin (created_at)')
+
+
+def drop_created_at_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS message_created_at_brin_idx')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('message_control', '0012_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_key', models.CharField(max_length=50)),
+                ('month', models.DateTimeField()),
+                ('file', models.FileField(upload_to='')),
+                ('message_count', models.PositiveIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('conversation_key', 'month'),
+                'unique_together': {('conversation_key', 'month')},
+            },
+        ),
+        migrations.RunPython(create_created_at_index, drop_created_at_index),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# unaccent() is only STABLE, an IMMUTABLE wrapper can be used in an index
+CREATE_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION message_search_unaccent(text) RETURNS text AS "
+    "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$ "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT")
+
+
+def unaccent_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # same expression as message_control.search.TSVECTOR_TEMPLATE
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    schema_editor.execute(CREATE_FUNCTION)
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS message_search_unaccent_idx ON message_control_message "
+        "USING gin (to_tsvector('simple'::regconfig, message_search_unaccent(COALESCE(message, ''))))")
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS message_search_vector_idx")
+
+
+def restore_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS message_search_vector_idx ON message_control_message "
+        "USING gin (to_tsvector('simple'::regconfig, COALESCE(message, '')))")
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS message_search_unaccent_idx")
+    schema_editor.execute("DROP FUNCTION IF EXISTS message_search_unaccent(text)")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('message_control', '0013_message_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(unaccent_search_index, restore_search_index),
+    ]
@@ -1,14 +1,44 @@
+import uuid
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+
+class StoredBlob(models.Model):
+    """
+    One stored copy of a file's content, shared by every upload with the
+    same sha256 and deleted once no upload points to it anymore.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField()
+    thumbnail = models.FileField(blank=True, default="")
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
 
 
 class GenericFileUpload(models.Model):
     file_upload = models.FileField()
+    blob = models.ForeignKey(
+        StoredBlob, related_name="uploads", null=True, blank=True, on_delete=models.PROTECT)
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.file_upload}"
 
 
+@receiver(post_delete, sender=GenericFileUpload)
+def release_upload_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        from .blobs import release_blob
+        release_blob(instance.blob_id)
+
+
 class Message(models.Model):
     sender = models.ForeignKey(
         "user_control.CustomUser", related_name="message_sender", on_delete=models.CASCADE)
@@ -16,14 +46,62 @@ class Message(models.Model):
         "user_control.CustomUser", related_name="message_receiver", on_delete=models.CASCADE)
     message = models.TextField(blank=True, null=True)
     is_read = models.BooleanField(default=False)
+    conversation_key = models.CharField(max_length=50, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"message between {self.sender.username} and {self.receiver.username}"
 
+    @staticmethod
+    def get_conversation_key(user_id, other_user_id):
+        # the same key for both directions of a conversation
+        first, second = sorted((int(user_id), int(other_user_id)))
+        return f"{first}:{second}"
+
+    def save(self, *args, **kwargs):
+        self.conversation_key = Message.get_conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["conversation_key", "created_at", "id"], name="message_conversation_idx"),
+            models.Index(fields=["receiver", "sender", "is_read"], name="message_unread_idx"),
+        ]
+
+
+class MessageArchive(models.Model):
+    """
+    One month of a conversation moved out of the message table into a
+    gzipped JSON lines file, see message_control/archive.py.
+    """
+    conversation_key = models.CharField(max_length=50)
+    month = models.DateTimeField()
+    file = models.FileField()
+    message_count = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("conversation_key", "month")
+        unique_together = ("conversation_key", "month")
+
+
+class MessageSearchTerm(models.Model):
+    """
+    Inverted index over Message.message on databases without full-text
+    search, see message_control/search.py.
+    """
+    term = models.CharField(max_length=64)
+    message = models.ForeignKey(Message, related_name="+", on_delete=models.CASCADE)
+    frequency = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "message"], name="message_search_term_idx"),
+        ]
 
 
 class MessageAttachment(models.Model):
@@ -36,3 +114,92 @@ class MessageAttachment(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+
+
+class Conversation(models.Model):
+    key = models.CharField(max_length=50, unique=True)
+    first_user = models.ForeignKey(
+        "user_control.CustomUser", related_name="first_user_conversations", on_delete=models.CASCADE)
+    second_user = models.ForeignKey(
+        "user_control.CustomUser", related_name="second_user_conversations", on_delete=models.CASCADE)
+    first_user_unread = models.PositiveIntegerField(default=0)
+    second_user_unread = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey(
+        Message, related_name="+", on_delete=models.SET_NULL, null=True)
+    last_message_preview = models.CharField(max_length=255, blank=True, default="")
+    last_message_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"conversation {self.key}"
+
+    def get_peer(self, user_id):
+        if self.first_user_id == user_id:
+            return self.second_user
+        return self.first_user
+
+    def get_unread(self, user_id):
+        if self.first_user_id == user_id:
+            return self.first_user_unread
+        return self.second_user_unread
+
+    class Meta:
+        ordering = ("-last_message_at",)
+        indexes = [
+            models.Index(fields=["first_user", "last_message_at", "id"], name="conversation_first_user_idx"),
+            models.Index(fields=["second_user", "last_message_at", "id"], name="conversation_second_user_idx"),
+        ]
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        "user_control.CustomUser", related_name="upload_sessions", on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    upload_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"upload of {self.file_name}"
+
+    class Meta:
+        ordering = ("created_at",)
+
+
+class UploadPart(models.Model):
+    session = models.ForeignKey(
+        UploadSession, related_name="parts", on_delete=models.CASCADE)
+    part_number = models.PositiveIntegerField()
+    etag = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("part_number",)
+        unique_together = (("session", "part_number"),)
+
+
+class Change(models.Model):
+    """
+    Feed of what each user has to sync. The id is the sequence clients
+    resume from, rows without a user are seen by everyone.
+    """
+    MESSAGE = "message"
+    READ = "read"
+    PROFILE = "profile"
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(
+        "user_control.CustomUser", related_name="+", null=True, blank=True, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    data = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="change_user_seq_idx"),
+        ]
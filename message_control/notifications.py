@@ -0,0 +1,145 @@
+import json
+import logging
+import queue
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    """
+    Ships socket notifications from a background thread so API requests
+    never wait on the socket server.
+
+    Events are queued in memory (bounded, overflow is dropped and counted)
+    and posted over a keep-alive session. A single event is posted as is,
+    a batch holding more than one as {"version": 2, "events": [...]}.
+    """
+    batch_version = 2
+
+    def __init__(self, url, max_queue_size=10000, batch_size=50, timeout=3.0,
+                 max_retries=3, backoff=0.5, session=None):
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.session = session or self.get_session()
+        self.stats = {"enqueued": 0, "sent": 0, "dropped": 0, "failed": 0, "retried": 0}
+        self._stats_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @staticmethod
+    def get_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({'Content-Type': 'application/json'})
+        return session
+
+    def count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def enqueue(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.count("dropped")
+            return False
+        self.count("enqueued")
+        return True
+
+    def enqueue_many(self, events):
+        return sum(self.enqueue(event) for event in events)
+
+    def start(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self.run, name="notification-dispatcher", daemon=True)
+                self._worker.start()
+        return self._worker
+
+    def flush(self):
+        self.queue.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.send(batch)
+            except Exception:
+                # the worker has to outlive a bad batch
+                logger.exception("Unable to send %s notifications", len(batch))
+                self.count("failed", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def get_payload(self, batch):
+        if len(batch) == 1:
+            return batch[0]
+        return {"version": self.batch_version, "events": batch}
+
+    def send(self, batch):
+        data = json.dumps(self.get_payload(batch))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.count("retried")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(self.url, data, timeout=self.timeout)
+            except requests.RequestException:
+                continue
+            if 200 <= response.status_code < 300:
+                self.count("sent", len(batch))
+                return True
+            if response.status_code < 500 and response.status_code != 429:
+                # rejected, sending it again won't help
+                logger.warning("Socket server rejected %s notifications with %s",
+                               len(batch), response.status_code)
+                break
+        else:
+            logger.warning("Dropping %s notifications after %s attempts", len(batch), self.max_retries + 1)
+
+        self.count("failed", len(batch))
+        return False
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher(
+                settings.SOCKET_SERVER,
+                max_queue_size=settings.SOCKET_QUEUE_SIZE,
+                batch_size=settings.SOCKET_BATCH_SIZE,
+                timeout=settings.SOCKET_TIMEOUT,
+                max_retries=settings.SOCKET_MAX_RETRIES,
+            )
+            _dispatcher.start()
+    return _dispatcher
+
+
+def notify(*events):
+    if not settings.SOCKET_SERVER or not events:
+        return 0
+    return get_dispatcher().enqueue_many(events)
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import socket
+import threading
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """
+    A websocket connected to this worker. Events can be pushed from any
+    thread, they are handed to the connection's event loop.
+    """
+
+    def __init__(self, loop, max_pending=100):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def push(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Dropping realtime event for a slow connection")
+
+
+class ConnectionRegistry:
+    """
+    In-memory map of user id to the websockets open on this worker.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def register(self, user_id, connection):
+        with self._lock:
+            self._connections.setdefault(user_id, set()).add(connection)
+
+    def unregister(self, user_id, connection):
+        with self._lock:
+            connections = self._connections.get(user_id, set())
+            connections.discard(connection)
+            if not connections:
+                self._connections.pop(user_id, None)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            connections = list(self._connections.get(user_id, ()))
+        for connection in connections:
+            connection.push(event)
+        return len(connections)
+
+
+class BaseFanout:
+    """
+    Routes an event to every worker that may hold a websocket for the user.
+    """
+
+    def __init__(self, registry, **options):
+        # REALTIME_FANOUT["OPTIONS"] holds the options of the other backends
+        self.registry = registry
+
+    def start(self):
+        pass
+
+    def publish(self, user_id, event):
+        raise NotImplementedError
+
+
+class InMemoryFanout(BaseFanout):
+    """
+    Single process deployments: deliver straight to the local registry.
+    """
+
+    def publish(self, user_id, event):
+        self.registry.deliver(user_id, event)
+
+
+class UDPFanout(BaseFanout):
+    """
+    Multi-process deployments on one host: worker `worker_index` of
+    `workers` listens on `port` + worker_index, every event is delivered
+    to the worker's own websockets and sent as a datagram to the others.
+
+    Datagrams are signed with `secret` (SECRET_KEY by default), unsigned
+    ones are dropped. Events too large for a datagram are replaced by a
+    reference carrying their type and id, clients fetch the rest.
+    """
+    max_datagram_size = 60000
+    digest_size = hashlib.sha256().digest_size
+
+    def __init__(self, registry, host="127.0.0.1", port=0, workers=1, worker_index=0, secret=None, **options):
+        super().__init__(registry)
+        if not 0 <= worker_index < workers:
+            raise ImproperlyConfigured(f"REALTIME_WORKER_INDEX must be between 0 and {workers - 1}")
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # port 0 binds any free port and has no peers, for tests
+        self.socket.bind((host, port + worker_index if port else 0))
+        self.address = self.socket.getsockname()
+        self.peers = [(host, port + index) for index in range(workers) if port and index != worker_index]
+        self.secret = (secret or settings.SECRET_KEY).encode()
+        self._listener = None
+
+    def sign(self, data):
+        return hmac.new(self.secret, data, hashlib.sha256).digest()
+
+    def start(self):
+        if self._listener is None:
+            self._listener = threading.Thread(target=self.listen, name="realtime-fanout", daemon=True)
+            self._listener.start()
+
+    def listen(self):
+        while True:
+            datagram, _ = self.socket.recvfrom(65535)
+            signature, data = datagram[:self.digest_size], datagram[self.digest_size:]
+            if not hmac.compare_digest(signature, self.sign(data)):
+                logger.warning("Ignoring unsigned realtime datagram")
+                continue
+            try:
+                payload = json.loads(data)
+                self.registry.deliver(payload["user_id"], payload["event"])
+            except (ValueError, KeyError):
+                logger.warning("Ignoring malformed realtime datagram")
+
+    @staticmethod
+    def get_reference(event):
+        data = event.get("data", None)
+        reference = {"type": event.get("type", None), "truncated": True}
+        if isinstance(data, dict) and "id" in data:
+            reference["data"] = {"id": data["id"]}
+        return reference
+
+    def encode(self, user_id, event):
+        data = json.dumps({"user_id": user_id, "event": event}, cls=DjangoJSONEncoder).encode()
+        return self.sign(data) + data
+
+    def publish(self, user_id, event):
+        self.registry.deliver(user_id, event)
+        datagram = self.encode(user_id, event)
+        if len(datagram) > self.max_datagram_size:
+            datagram = self.encode(user_id, self.get_reference(event))
+        for peer in self.peers:
+            try:
+                self.socket.sendto(datagram, peer)
+            except OSError:
+                logger.warning("Could not send a realtime event to %s:%s", *peer, exc_info=True)
+
+
+registry = ConnectionRegistry()
+_fanout = None
+_fanout_lock = threading.Lock()
+
+
+def get_fanout():
+    global _fanout
+    with _fanout_lock:
+        if _fanout is None:
+            backend = import_string(settings.REALTIME_FANOUT["BACKEND"])
+            _fanout = backend(registry, **settings.REALTIME_FANOUT.get("OPTIONS", {}))
+            _fanout.start()
+    return _fanout
+
+
+def publish(user_id, event):
+    # delivered once the surrounding transaction commits, never before
+    user_id = int(user_id)
+    transaction.on_commit(lambda: publish_now(user_id, event))
+
+
+def publish_now(user_id, event):
+    # the write is committed already, a broken fan-out must not fail the request
+    try:
+        get_fanout().publish(user_id, event)
+    except Exception:
+        logger.exception("Could not publish a realtime event")
+
+
+def get_token(scope):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("token"):
+        return query["token"][0]
+
+    headers = dict(scope.get("headers", []))
+    authorization = headers.get(b"authorization", b"").decode()
+    if authorization:
+        return authorization[7:]
+    return None
+
+
+async def websocket_application(scope, receive, send):
+    from user_control.authentication import Authentication
+
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    token = get_token(scope)
+    claims = Authentication.verify_access_token(token) if token else None
+    if not claims:
+        await send({"type": "websocket.close", "code": 4401})
+        return
+
+    get_fanout()
+    user_id = claims["user_id"]
+    connection = Connection(asyncio.get_event_loop())
+    registry.register(user_id, connection)
+    await send({"type": "websocket.accept"})
+
+    async def read():
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                return
+
+    async def write():
+        while True:
+            event = await connection.queue.get()
+            await send({"type": "websocket.send", "text": json.dumps(event, cls=DjangoJSONEncoder)})
+
+    tasks = [asyncio.ensure_future(read()), asyncio.ensure_future(write())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        registry.unregister(user_id, connection)
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,103 @@
+import re
+import unicodedata
+from collections import Counter
+from django.db import connection
+from django.db.models import Count, F, Func, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast
+from chatapi.pagination import KeysetPagination
+from user_control.search import normalize_text
+from .models import MessageSearchTerm
+
+MAX_TERM_LENGTH = 64
+SNIPPET_RADIUS = 60
+# kept in sync with the index created by migration 0014, messages and
+# queries are unaccented like tokenize() does on the other databases
+UNACCENT_FUNCTION = "message_search_unaccent"
+TSVECTOR_TEMPLATE = "to_tsvector('simple'::regconfig, message_search_unaccent(COALESCE(%(expressions)s, '')))"
+
+
+def tokenize(text):
+    return [term for term in re.findall(r"\w+", normalize_text(text)) if len(term) <= MAX_TERM_LENGTH]
+
+
+def uses_tsvector():
+    """
+    PostgreSQL searches through a GIN index over to_tsvector(message), the
+    other databases through the MessageSearchTerm table.
+    """
+    return connection.vendor == "postgresql"
+
+
+def index_messages(messages):
+    """
+    Rebuilds the terms of the given messages, called whenever messages are
+    created or edited. Deleted messages drop their terms by cascade.
+    """
+    if uses_tsvector():
+        return
+    messages = list(messages)
+    MessageSearchTerm.objects.filter(message_id__in=[message.id for message in messages]).delete()
+    MessageSearchTerm.objects.bulk_create([
+        MessageSearchTerm(term=term, message_id=message.id, frequency=frequency)
+        for message in messages
+        for term, frequency in Counter(tokenize(message.message)).items()
+    ])
+
+
+def search_messages(queryset, terms):
+    """
+    Messages of queryset holding every term, annotated with an integer
+    search_rank (integers keep keyset cursors exact).
+    """
+    if uses_tsvector():
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+
+        vector = Func(F("message"), template=TSVECTOR_TEMPLATE, output_field=SearchVectorField())
+        query = SearchQuery(Func(Value(" ".join(terms)), function=UNACCENT_FUNCTION), config="simple")
+        return queryset.annotate(search_vector=vector).filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(vector, query) * 1000000, IntegerField()))
+
+    matches = MessageSearchTerm.objects.filter(term__in=set(terms)).values("message_id").annotate(
+        matched=Count("term", distinct=True), score=Sum("frequency")).filter(matched=len(set(terms)))
+    return queryset.filter(id__in=matches.values("message_id")).annotate(
+        search_rank=Subquery(matches.filter(message_id=OuterRef("id")).values("score")[:1]))
+
+
+def fold(text):
+    """
+    Lowercased, accent free text with the offset of each folded character
+    in the original.
+    """
+    folded, offsets = [], []
+    for index, char in enumerate(text):
+        for part in unicodedata.normalize("NFKD", char):
+            if not unicodedata.combining(part):
+                folded.append(part.lower())
+                offsets.append(index)
+    return "".join(folded), offsets
+
+
+def get_snippet(text, terms):
+    """
+    Part of text around the first match, with the [start, end) offsets of
+    every matched term in it.
+    """
+    text = text or ""
+    folded, offsets = fold(text)
+    pattern = re.compile(r"\b(?:%s)\b" % "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)))
+    matches = [(offsets[match.start()], offsets[match.end() - 1] + 1) for match in pattern.finditer(folded)]
+    if not matches:
+        return {"snippet": text[:SNIPPET_RADIUS * 2], "highlights": []}
+
+    start = max(matches[0][0] - SNIPPET_RADIUS, 0)
+    end = min(matches[0][1] + SNIPPET_RADIUS, len(text))
+    return {
+        "snippet": text[start:end],
+        "highlights": [[match_start - start, match_end - start]
+                       for match_start, match_end in matches if match_start >= start and match_end <= end],
+    }
+
+
+class MessageSearchPagination(KeysetPagination):
+    ordering = ("-search_rank", "-created_at", "-id")
+    legacy_query_param = None
@@ -1,12 +1,59 @@
 from rest_framework import serializers
-from .models import GenericFileUpload, Message, MessageAttachment
+from django.db.models import Manager
+from .blobs import store_file
+from .search import get_snippet
+from .unread import get_unread_counts
+from .models import GenericFileUpload, Message, MessageAttachment, Conversation, UploadSession
+
+
+def get_viewer_id(context):
+    try:
+        return context["request"].user.id
+    except Exception:
+        return None
+
+
+class SparseFieldsMixin:
+    """
+    Serializes only the fields named in the `fields` argument when it is
+    given, the others (nested serializers included) are never evaluated.
+    Unknown names are ignored.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 class GenericFileUploadSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField("get_thumbnail")
 
     class Meta:
         model = GenericFileUpload
         fields = "__all__"
+        read_only_fields = ("blob", "size", "content_type")
+
+    def get_thumbnail(self, obj):
+        # querysets select the blob along with the upload
+        if not obj.blob_id or not obj.blob.thumbnail:
+            return None
+        url = obj.blob.thumbnail.url
+        request = self.context.get("request", None)
+        return request.build_absolute_uri(url) if request else url
+
+    def create(self, validated_data):
+        file_upload = validated_data["file_upload"]
+        return store_file(file_upload, getattr(file_upload, "content_type", None) or "")
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    parts = serializers.SlugRelatedField(slug_field="part_number", many=True, read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ("id", "file_name", "content_type", "parts", "created_at")
 
 
 class MessageAttachmentSerializer(serializers.ModelSerializer):
@@ -17,7 +64,22 @@ class MessageAttachmentSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        messages = list(data.all() if isinstance(data, Manager) else data)
+        if not {"sender", "receiver"} & set(self.child.fields):
+            return super().to_representation(messages)
+
+        user_ids = set()
+        for message in messages:
+            user_ids.update((message.sender_id, message.receiver_id))
+        self.context["unread_counts"] = get_unread_counts(
+            get_viewer_id(self.context), user_ids)
+        return super().to_representation(messages)
+
+
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     sender = serializers.SerializerMethodField("get_sender_data")
     sender_id = serializers.IntegerField(write_only=True)
     receiver = serializers.SerializerMethodField("get_receiver_data")
@@ -28,11 +90,98 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = "__all__"
+        list_serializer_class = MessageListSerializer
+
+    def to_representation(self, instance):
+        if "unread_counts" not in self.context:
+            self.context["unread_counts"] = get_unread_counts(
+                get_viewer_id(self.context), (instance.sender_id, instance.receiver_id))
+        return super().to_representation(instance)
 
     def get_receiver_data(self, obj):
         from user_control.serializers import UserProfileSerializer
-        return UserProfileSerializer(obj.receiver.user_profile).data
+        return UserProfileSerializer(obj.receiver.user_profile, context=self.context).data
 
     def get_sender_data(self, obj):
         from user_control.serializers import UserProfileSerializer
-        return UserProfileSerializer(obj.sender.user_profile).data
+        return UserProfileSerializer(obj.sender.user_profile, context=self.context).data
+
+
+class CompactMessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Listing payload that refers to the sender and receiver by id, their
+    profiles are sent once per page in the `users` side-table.
+    """
+    sender = serializers.IntegerField(source="sender_id", read_only=True)
+    receiver = serializers.IntegerField(source="receiver_id", read_only=True)
+    message_attachments = MessageAttachmentSerializer(read_only=True, many=True)
+
+    class Meta:
+        model = Message
+        fields = ("id", "sender", "receiver", "message", "message_attachments", "is_read",
+                  "conversation_key", "created_at", "updated_at")
+
+
+class MessageSearchSerializer(MessageSerializer):
+    match = serializers.SerializerMethodField("get_match")
+
+    def get_match(self, obj):
+        return get_snippet(obj.message, self.context.get("search_terms", []))
+
+
+class BulkAttachmentSerializer(serializers.Serializer):
+    attachment_id = serializers.IntegerField()
+    caption = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+
+
+class BulkMessageSerializer(serializers.Serializer):
+    sender_id = serializers.IntegerField(required=False)
+    receiver_id = serializers.IntegerField()
+    message = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    attachments = BulkAttachmentSerializer(many=True, required=False)
+
+
+class ReadConversationSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    up_to_id = serializers.IntegerField(required=False)
+    up_to = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if "up_to_id" not in attrs and "up_to" not in attrs:
+            raise serializers.ValidationError("Either up_to_id or up_to is required.")
+        return attrs
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    user = serializers.SerializerMethodField("get_user_data")
+    unread_count = serializers.SerializerMethodField("get_unread_count")
+
+    class Meta:
+        model = Conversation
+        fields = ("id", "key", "user", "last_message", "last_message_preview",
+                  "last_message_at", "unread_count")
+
+    def get_user_data(self, obj):
+        peer = obj.get_peer(get_viewer_id(self.context))
+        data = {
+            "id": peer.id,
+            "username": peer.username,
+            "is_online": serializers.DateTimeField().to_representation(peer.is_online),
+            "first_name": None,
+            "last_name": None,
+            "profile_picture": None,
+        }
+        try:
+            profile = peer.user_profile
+        except Exception:
+            return data
+
+        data["first_name"] = profile.first_name
+        data["last_name"] = profile.last_name
+        if profile.profile_picture:
+            data["profile_picture"] = GenericFileUploadSerializer(
+                profile.profile_picture, context=self.context).data
+        return data
+
+    def get_unread_count(self, obj):
+        return obj.get_unread(get_viewer_id(self.context))
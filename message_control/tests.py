@@ -1,9 +1,34 @@
 from rest_framework.test import APITestCase
+from django.test import override_settings
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from six import BytesIO
 from pil import Image
+from .models import GenericFileUpload, Message, MessageAttachment
 import json
+import shutil
+import tempfile
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# a cache the reconcile_unread process shares with the workers
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tempfile.mkdtemp()},
+    "profiles": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "KEY_PREFIX": "profiles"},
+}
+
+
+# requests would start the presence flusher thread, which locks the test database
+NO_PRESENCE_FLUSHER = override_settings(PRESENCE_FLUSH_INTERVAL=0)
+
+
+def setUpModule():
+    NO_PRESENCE_FLUSHER.enable()
+
+
+def tearDownModule():
+    NO_PRESENCE_FLUSHER.disable()
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+    shutil.rmtree(SHARED_CACHES["default"]["LOCATION"], ignore_errors=True)
 
 
 def create_image(storage, filename, size=(100, 100), image_mode='RGB', image_format='PNG'):
@@ -180,3 +205,1197 @@ class TestMessage(APITestCase):
         result = response.json()
 
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestMessageQueries(APITestCase):
+    message_url = "/message/message"
+    login_url = "/user/login"
+
+    def setUp(self):
+        from user_control.models import CustomUser, UserProfile
+
+        payload = {
+            "username": "sender",
+            "password": "sender123",
+            "email": "adefemigreat@yahoo.com"
+        }
+
+        self.sender = CustomUser.objects.create_user(**payload)
+        UserProfile.objects.create(
+            first_name="sender", last_name="sender", user=self.sender, caption="sender", about="sender")
+
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            'HTTP_AUTHORIZATION': 'Bearer {}'.format(response.json()['access'])}
+
+        self.receiver = CustomUser.objects.create_user(
+            "receiver", "receiver123", email="ade123@yahoo.com")
+        UserProfile.objects.create(
+            first_name="receiver", last_name="receiver", user=self.receiver, caption="receiver", about="receiver")
+
+        self.upload = GenericFileUpload.objects.create(
+            file_upload=SimpleUploadedFile('front1.png', create_image(None, 'avatar.png').getvalue()))
+
+    def create_messages(self, count):
+        for i in range(count):
+            message = Message.objects.create(
+                sender=self.receiver, receiver=self.sender, message=f"message {i}")
+            MessageAttachment.objects.create(message=message, attachment=self.upload)
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def count_list_queries(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        # the messages are created directly, so count with cold unread counters
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                self.message_url+f"?user_id={self.receiver.id}", **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_list_query_count_is_constant(self):
+        self.create_messages(2)
+        small_page, _ = self.count_list_queries()
+
+        self.create_messages(10)
+        large_page, result = self.count_list_queries()
+
+        self.assertEqual(small_page, large_page)
+        self.assertEqual(len(result["results"]), 12)
+        # unread badges are shared across the page
+        self.assertEqual(result["results"][0]["sender"]["message_count"], 12)
+        self.assertEqual(result["results"][0]["receiver"]["message_count"], 0)
+
+    def test_keyset_pagination(self):
+        self.create_messages(25)
+
+        response = self.client.get(
+            self.message_url+f"?user_id={self.receiver.id}", **self.bearer)
+        first_page = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", first_page)
+        self.assertEqual(len(first_page["results"]), 20)
+        self.assertEqual(first_page["results"][0]["message"], "message 24")
+        self.assertIsNone(first_page["previous"])
+
+        # scroll back to older messages
+        response = self.client.get(first_page["next"], **self.bearer)
+        second_page = response.json()
+
+        self.assertEqual(len(second_page["results"]), 5)
+        self.assertEqual(second_page["results"][-1]["message"], "message 0")
+        self.assertIsNone(second_page["next"])
+
+        # and forward again
+        response = self.client.get(second_page["previous"], **self.bearer)
+        self.assertEqual(
+            [row["id"] for row in response.json()["results"]],
+            [row["id"] for row in first_page["results"]])
+
+        response = self.client.get(
+            self.message_url+f"?user_id={self.receiver.id}&before=invalid", **self.bearer)
+        self.assertEqual(response.status_code, 404)
+
+    def test_conversation_key_backfill(self):
+        from importlib import import_module
+        from types import SimpleNamespace
+        from django.apps import apps
+        from django.db import connection
+
+        migration = import_module("message_control.migrations.0004_backfill_conversation_key")
+
+        Message.objects.create(sender=self.sender, receiver=self.receiver, message="sent")
+        Message.objects.create(sender=self.receiver, receiver=self.sender, message="received")
+        Message.objects.update(conversation_key=None)
+
+        migration.backfill_conversation_key(apps, SimpleNamespace(connection=connection))
+
+        key = Message.get_conversation_key(self.receiver.id, self.sender.id)
+        self.assertEqual(Message.objects.filter(conversation_key=key).count(), 2)
+
+        response = self.client.get(
+            self.message_url+f"?user_id={self.receiver.id}", **self.bearer)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class ConversationTestCase(APITestCase):
+    message_url = "/message/message"
+    inbox_url = "/message/inbox"
+    read_url = "/message/read-messages"
+    login_url = "/user/login"
+
+    def setUp(self):
+        from user_control.models import CustomUser, UserProfile
+
+        self.users = []
+        self.bearers = []
+        for name in ("first", "second", "third"):
+            payload = {
+                "username": name,
+                "password": f"{name}123",
+                "email": f"{name}@yahoo.com"
+            }
+            user = CustomUser.objects.create_user(**payload)
+            UserProfile.objects.create(
+                first_name=name, last_name=name, user=user, caption=name, about=name)
+            response = self.client.post(self.login_url, data=payload)
+            self.users.append(user)
+            self.bearers.append({
+                'HTTP_AUTHORIZATION': 'Bearer {}'.format(response.json()['access'])})
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def send(self, sender, receiver, message):
+        response = self.client.post(self.message_url, data={
+            "sender_id": self.users[sender].id,
+            "receiver_id": self.users[receiver].id,
+            "message": message,
+        }, **self.bearers[sender])
+        return response.json()
+
+
+class TestInbox(ConversationTestCase):
+
+    def test_inbox(self):
+        self.send(1, 0, "hello from second")
+        self.send(1, 0, "are you there?")
+        last = self.send(2, 0, "hello from third")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.inbox_url, **self.bearers[0])
+        result = response.json()["results"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["user"]["username"] for row in result], ["third", "second"])
+        self.assertEqual(result[0]["last_message"], last["id"])
+        self.assertEqual(result[1]["last_message_preview"], "are you there?")
+        self.assertEqual([row["unread_count"] for row in result], [1, 2])
+
+        # the sender has nothing unread
+        response = self.client.get(self.inbox_url, **self.bearers[1])
+        self.assertEqual(response.json()["results"][0]["unread_count"], 0)
+
+        # reading and deleting keep the summary in sync
+        self.client.post(self.read_url, data={"message_ids": [last["id"]]}, format="json", **self.bearers[0])
+        self.client.delete(self.message_url + f"/{last['id']}", **self.bearers[2])
+
+        response = self.client.get(self.inbox_url, **self.bearers[0])
+        result = response.json()["results"]
+        self.assertEqual([row["user"]["username"] for row in result], ["second"])
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TestUnreadCounters(ConversationTestCase):
+    unread_url = "/message/unread-count"
+    profile_url = "/user/profile"
+
+    def get_badges(self, user):
+        response = self.client.get(self.profile_url, **self.bearers[user])
+        return {row["user"]["username"]: row["message_count"] for row in response.json()["results"]}
+
+    def test_counters_follow_messages(self):
+        from django.core.cache import cache
+        from .unread import pair_key
+
+        first = self.send(1, 0, "one")
+        self.send(1, 0, "two")
+        self.send(2, 0, "three")
+
+        self.assertEqual(self.get_badges(0), {"second": 2, "third": 1})
+        self.assertEqual(self.client.get(self.unread_url, **self.bearers[0]).json(), {"total": 3})
+
+        # served from the shared counters, which messages bump in place
+        self.assertEqual(cache.get(pair_key(self.users[0].id, self.users[1].id)), 2)
+        self.send(1, 0, "four")
+        with self.assertNumQueries(0):
+            response = self.client.get(self.unread_url, **self.bearers[0])
+        self.assertEqual(response.json(), {"total": 4})
+        self.assertEqual(self.get_badges(0)["second"], 3)
+
+        self.client.post(self.read_url, data={"message_ids": [first["id"]]}, format="json", **self.bearers[0])
+        self.assertEqual(self.get_badges(0)["second"], 2)
+        self.assertEqual(self.client.get(self.unread_url, **self.bearers[0]).json(), {"total": 3})
+
+        self.client.patch(self.message_url + f"/{first['id']}", data={"is_read": False}, **self.bearers[1])
+        self.assertEqual(self.get_badges(0)["second"], 3)
+
+    def test_reconcile(self):
+        from django.core.management import call_command
+        from io import StringIO
+
+        self.send(1, 0, "one")
+        self.assertEqual(self.get_badges(0)["second"], 1)
+
+        # changed behind the counters' back
+        Message.objects.update(is_read=True)
+        self.assertEqual(self.get_badges(0)["second"], 1)
+
+        call_command("reconcile_unread", stdout=StringIO())
+        self.assertEqual(self.get_badges(0)["second"], 0)
+        self.assertEqual(self.client.get(self.unread_url, **self.bearers[0]).json(), {"total": 0})
+
+    @override_settings(CACHES=dict(SHARED_CACHES, default={"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}))
+    def test_local_cache_counts(self):
+        from django.core.cache import cache
+        from .unread import pair_key, total_key
+
+        self.send(1, 0, "one")
+        self.assertEqual(self.get_badges(0)["second"], 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.unread_url, **self.bearers[0]).json(), {"total": 1})
+
+        # nothing is cached in the process
+        keys = [pair_key(self.users[0].id, self.users[1].id), total_key(self.users[0].id)]
+        self.assertEqual(cache.get_many(keys), {})
+        Message.objects.update(is_read=True)
+        self.assertEqual(self.get_badges(0)["second"], 0)
+        self.assertEqual(self.client.get(self.unread_url, **self.bearers[0]).json(), {"total": 0})
+
+
+class TestReadReceipts(ConversationTestCase):
+    read_conversation_url = "/message/read-conversation"
+
+    def read(self, user, data):
+        from unittest import mock
+
+        with mock.patch("message_control.views.publish") as publish:
+            response = self.client.post(self.read_conversation_url, data=data, **self.bearers[user])
+        return response, publish
+
+    def test_read_up_to_message(self):
+        messages = [self.send(1, 0, f"message {i}") for i in range(3)]
+        self.send(0, 1, "reply")
+
+        response, publish = self.read(0, {"user_id": self.users[1].id, "up_to_id": messages[1]["id"]})
+        self.assertEqual(response.json(), {"updated": 2})
+        publish.assert_called_once()
+        self.assertEqual(publish.call_args[0][0], self.users[1].id)
+        self.assertEqual(publish.call_args[0][1]["type"], "message.read")
+
+        self.assertEqual(list(Message.objects.filter(is_read=False).values_list("message", flat=True).order_by(
+            "id")), ["message 2", "reply"])
+
+        # already read, nothing to publish
+        response, publish = self.read(0, {"user_id": self.users[1].id, "up_to_id": messages[1]["id"]})
+        self.assertEqual(response.json(), {"updated": 0})
+        publish.assert_not_called()
+
+    def test_read_up_to_time_is_scoped_to_receiver(self):
+        from django.utils import timezone
+
+        self.send(1, 0, "one")
+        self.send(0, 1, "two")
+
+        response, _ = self.read(0, {"user_id": self.users[1].id, "up_to": timezone.now().isoformat()})
+        self.assertEqual(response.json(), {"updated": 1})
+        self.assertEqual(Message.objects.get(is_read=False).message, "two")
+
+        response, _ = self.read(0, {"user_id": self.users[1].id})
+        self.assertEqual(response.status_code, 400)
+
+        # the other user's messages can't be used as a bound
+        other = self.send(2, 1, "three")
+        response, _ = self.read(0, {"user_id": self.users[1].id, "up_to_id": other["id"]})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class TestSync(ConversationTestCase):
+    sync_url = "/message/sync"
+
+    def sync(self, user, token, **params):
+        params["since"] = token
+        return self.client.get(self.sync_url, data=params, **self.bearers[user]).json()
+
+    def test_changes_since_token(self):
+        from user_control.models import UserProfile
+
+        token = self.client.get(self.sync_url, **self.bearers[0]).json()["next"]
+        other_token = self.client.get(self.sync_url, **self.bearers[2]).json()["next"]
+
+        kept = self.send(1, 0, "kept")
+        deleted = self.send(1, 0, "deleted")
+        self.client.patch(self.message_url + f"/{kept['id']}", data={"message": "edited"}, **self.bearers[1])
+        self.client.delete(self.message_url + f"/{deleted['id']}", **self.bearers[1])
+        self.client.post("/message/read-conversation", data={
+            "user_id": self.users[1].id, "up_to_id": kept["id"]}, **self.bearers[0])
+        profile = UserProfile.objects.get(user=self.users[2])
+        profile.caption = "new caption"
+        profile.save()
+
+        result = self.sync(0, token)
+        changes = [(change["type"], change["id"], change["deleted"]) for change in result["changes"]]
+        self.assertEqual(changes, [
+            ("message", kept["id"], False),
+            ("message", deleted["id"], True),
+            ("read", self.users[0].id, False),
+            ("profile", profile.id, False),
+        ])
+        self.assertEqual(result["changes"][0]["data"]["message"], "edited")
+        self.assertEqual(result["changes"][2]["data"]["up_to_id"], kept["id"])
+        self.assertEqual(result["changes"][3]["data"]["caption"], "new caption")
+        self.assertFalse(result["has_more"])
+
+        # nothing new since
+        self.assertEqual(self.sync(0, result["next"])["changes"], [])
+
+        # paginated by sequence, messages come in their current state
+        first_page = self.sync(0, token, limit=1)
+        self.assertTrue(first_page["has_more"])
+        self.assertEqual([change["id"] for change in first_page["changes"]], [kept["id"]])
+        self.assertEqual(first_page["changes"][0]["data"]["message"], "edited")
+        # the deleted message's creation is skipped, its tombstone follows
+        second_page = self.sync(0, first_page["next"], limit=3)
+        self.assertEqual([(change["id"], change["deleted"]) for change in second_page["changes"]],
+                         [(kept["id"], False), (deleted["id"], True)])
+
+        # other users only see the shared profile feed
+        changes = self.sync(2, other_token)["changes"]
+        self.assertEqual([change["type"] for change in changes], ["profile"])
+
+    def test_recent_changes_are_held_back(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Change
+
+        token = self.client.get(self.sync_url, **self.bearers[0]).json()["next"]
+        old = self.send(1, 0, "old")
+        recent = self.send(1, 0, "recent")
+        Change.objects.filter(object_id=old["id"]).update(created_at=timezone.now() - timedelta(seconds=30))
+
+        with self.settings(SYNC_SETTLE_SECONDS=10):
+            result = self.sync(0, token)
+            self.assertEqual([change["id"] for change in result["changes"]], [old["id"]])
+            self.assertFalse(result["has_more"])
+            # the position handed out for a full fetch is settled as well
+            self.assertEqual(self.sync(0, self.client.get(self.sync_url, **self.bearers[0]).json()["next"])["changes"],
+                             [])
+
+        result = self.sync(0, result["next"])
+        self.assertEqual([change["id"] for change in result["changes"]], [recent["id"]])
+
+    def test_invalid_token(self):
+        token = self.client.get(self.sync_url, **self.bearers[0]).json()["next"]
+        response = self.client.get(self.sync_url, data={"since": token}, **self.bearers[1])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.sync_url, data={"since": "garbage"}, **self.bearers[0])
+        self.assertEqual(response.status_code, 400)
+
+
+class TestConditionalMessages(ConversationTestCase):
+
+    def get_conversation(self, etag=None):
+        headers = dict(self.bearers[0])
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        return self.client.get(self.message_url, data={"user_id": self.users[1].id}, **headers)
+
+    def test_messages_not_modified(self):
+        message = self.send(1, 0, "hello")
+        etag = self.get_conversation()["ETag"]
+
+        with self.assertNumQueries(2):
+            response = self.get_conversation(etag)
+        self.assertEqual(response.status_code, 304)
+
+        # edits, new messages and reads all touch the conversation
+        self.client.patch(self.message_url + f"/{message['id']}", data={"message": "edited"}, **self.bearers[1])
+        response = self.get_conversation(etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.client.post("/message/read-conversation", data={
+            "user_id": self.users[1].id, "up_to_id": message["id"]}, **self.bearers[0])
+        self.assertEqual(self.get_conversation(etag).status_code, 200)
+
+    def test_listing_follows_presence(self):
+        from unittest import mock
+
+        self.send(1, 0, "hello")
+        etag = self.client.get(self.message_url, **self.bearers[0])["ETag"]
+        response = self.client.get(self.message_url, HTTP_IF_NONE_MATCH=etag, **self.bearers[0])
+        self.assertEqual(response.status_code, 304)
+
+        # the nested profiles show is_online, which moves once per throttle window
+        with mock.patch("message_control.views.get_presence_window", return_value=0):
+            response = self.client.get(self.message_url, HTTP_IF_NONE_MATCH=etag, **self.bearers[0])
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+    def test_thumbnail_changes_version(self):
+        from .thumbnails import generate_thumbnail
+
+        image = SimpleUploadedFile("face.png", create_image(None, "face.png").getvalue(), content_type="image/png")
+        image = self.client.post("/message/file-upload", data={"file_upload": image}).json()
+        message = self.send(1, 0, "look")
+        MessageAttachment.objects.create(message_id=message["id"], attachment_id=image["id"])
+        etag = self.get_conversation()["ETag"]
+        inbox = self.client.get(self.message_url, **self.bearers[0])["ETag"]
+
+        # the thumbnail is rendered after the upload is committed
+        generate_thumbnail(image["blob"])
+        response = self.get_conversation(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()["results"][0]["message_attachments"][0]["attachment"]["thumbnail"])
+        response = self.client.get(self.message_url, HTTP_IF_NONE_MATCH=inbox, **self.bearers[0])
+        self.assertEqual(response.status_code, 200)
+
+
+class TestMessageSearch(ConversationTestCase):
+    search_url = "/message/search"
+
+    def search(self, user, **params):
+        response = self.client.get(self.search_url, data=params, **self.bearers[user])
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_search(self):
+        self.send(1, 0, "Lunch at the café tomorrow?")
+        best = self.send(0, 1, "Cafe, cafe, CAFE. Tomorrow works")
+        edited = self.send(2, 0, "see you")
+        self.send(1, 2, "cafe between second and third")
+
+        result = self.search(0, q="cafe tomorrow")["results"]
+        self.assertEqual([row["id"] for row in result][0], best["id"])
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[1]["match"], {"snippet": "Lunch at the café tomorrow?", "highlights": [[13, 17], [18, 26]]})
+
+        # edits and deletes update the index
+        self.client.patch(self.message_url + f"/{edited['id']}", data={"message": "cafe?"}, **self.bearers[2])
+        self.assertEqual(len(self.search(0, q="cafe")["results"]), 3)
+        self.assertEqual(len(self.search(0, q="cafe", user_id=self.users[2].id)["results"]), 1)
+        self.client.delete(self.message_url + f"/{best['id']}", **self.bearers[0])
+        self.assertEqual(len(self.search(0, q="cafe")["results"]), 2)
+
+        first_page = self.search(0, q="cafe", page_size=1)
+        second_page = self.client.get(first_page["next"], **self.bearers[0]).json()
+        self.assertEqual(len(second_page["results"]), 1)
+        self.assertNotEqual(first_page["results"][0]["id"], second_page["results"][0]["id"])
+
+    def test_accented_terms(self):
+        accented = self.send(1, 0, "Un café crème")
+        plain = self.send(0, 1, "cafe creme")
+
+        for query in ("café", "CAFÉ crème", "cafe creme"):
+            result = self.search(0, q=query)["results"]
+            self.assertEqual({row["id"] for row in result}, {accented["id"], plain["id"]})
+
+    def test_reindex(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import MessageSearchTerm
+
+        self.send(1, 0, "hello world")
+        MessageSearchTerm.objects.all().delete()
+        self.assertEqual(self.search(0, q="hello")["results"], [])
+
+        call_command("reindex_messages", chunk_size=1, stdout=StringIO())
+        self.assertEqual(len(self.search(0, q="hello")["results"]), 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class TestReadReplicaRouting(ConversationTestCase):
+
+    def run_view(self, method, path, view_class, status=200, **headers):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from chatapi.db_router import ReadReplicaMiddleware, ReadReplicaRouter
+
+        seen = []
+
+        def view(request):
+            seen.append(ReadReplicaRouter().db_for_read(Message))
+            return HttpResponse(status=status)
+        view.cls = view_class
+
+        def get_response(request):
+            return middleware.process_view(request, view, (), {}) or view(request)
+
+        middleware = ReadReplicaMiddleware(get_response)
+        middleware(getattr(RequestFactory(), method)(path, **headers))
+        return seen[0]
+
+    def test_reads_are_routed_until_the_user_writes(self):
+        from .views import MessageView, ReadMultipleMessages
+
+        self.assertEqual(self.run_view("get", self.message_url, MessageView, **self.bearers[0]), "replica")
+        self.assertEqual(self.run_view("get", self.read_url, ReadMultipleMessages, **self.bearers[0]), "default")
+
+        # writes always go to the primary, failed ones don't pin the user
+        self.assertEqual(self.run_view("post", self.message_url, MessageView, status=400, **self.bearers[0]), "default")
+        self.assertEqual(self.run_view("get", self.message_url, MessageView, **self.bearers[0]), "replica")
+
+        self.run_view("post", self.message_url, MessageView, status=201, **self.bearers[0])
+        self.assertEqual(self.run_view("get", self.message_url, MessageView, **self.bearers[0]), "default")
+        # other users are not affected
+        self.assertEqual(self.run_view("get", self.message_url, MessageView, **self.bearers[1]), "replica")
+
+    def test_router(self):
+        from chatapi.db_router import ReadReplicaRouter, set_read_from_replica
+
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Message), "default")
+        previous = set_read_from_replica(True)
+        try:
+            self.assertEqual(router.db_for_read(Message), "replica")
+            self.assertEqual(router.db_for_write(Message), "default")
+        finally:
+            set_read_from_replica(previous)
+        self.assertFalse(router.allow_migrate("replica", "message_control"))
+        self.assertTrue(router.allow_migrate("default", "message_control"))
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TestCompactMessages(ConversationTestCase):
+
+    def test_compact_listing(self):
+        for index in range(20):
+            self.send(index % 2, (index + 1) % 2, f"message {index}")
+        url = self.message_url + f"?user_id={self.users[1].id}&page_size=20"
+
+        full = self.client.get(url, **self.bearers[0])
+        compact = self.client.get(url + "&representation=compact", **self.bearers[0])
+        self.assertLess(len(compact.content) * 5, len(full.content))
+
+        full, compact = full.json(), compact.json()
+        self.assertEqual([row["id"] for row in compact["results"]], [row["id"] for row in full["results"]])
+        row = compact["results"][0]
+        self.assertEqual((row["sender"], row["receiver"]), (self.users[1].id, self.users[0].id))
+        self.assertEqual(row["message"], "message 19")
+
+        users = {user["id"]: user for user in compact["users"]}
+        self.assertEqual(set(users), {self.users[0].id, self.users[1].id})
+        self.assertEqual(users[self.users[1].id]["username"], "second")
+        self.assertEqual(users[self.users[1].id]["first_name"], "second")
+        self.assertEqual(users[self.users[1].id]["message_count"],
+                         full["results"][0]["sender"]["message_count"])
+
+        # the same representation through the Accept header
+        accept = self.client.get(url, HTTP_ACCEPT='application/json; profile="compact"', **self.bearers[0])
+        self.assertEqual(accept.json(), compact)
+        self.assertIn("Accept", accept["Vary"])
+
+    def test_compact_etag(self):
+        self.send(0, 1, "hello")
+        url = self.message_url + f"?user_id={self.users[1].id}"
+        full = self.client.get(url, **self.bearers[0])
+        compact = self.client.get(url, HTTP_ACCEPT='application/json; profile="compact"', **self.bearers[0])
+        self.assertNotEqual(full["ETag"], compact["ETag"])
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json; profile="compact"',
+                                   HTTP_IF_NONE_MATCH=compact["ETag"], **self.bearers[0])
+        self.assertEqual(response.status_code, 304)
+
+    def test_sparse_fields(self):
+        self.send(0, 1, "hello")
+        url = self.message_url + f"?user_id={self.users[1].id}"
+
+        result = self.client.get(url + "&fields=id,message", **self.bearers[0]).json()
+        self.assertEqual(set(result["results"][0]), {"id", "message"})
+
+        result = self.client.get(
+            url + "&representation=compact&fields=id,sender&user_fields=id,username", **self.bearers[0]).json()
+        self.assertEqual(set(result["results"][0]), {"id", "sender"})
+        self.assertEqual(result["users"], [{"id": self.users[0].id, "username": "first"}])
+
+    def test_compact_queries(self):
+        for index in range(10):
+            self.send(index % 2, (index + 1) % 2, f"message {index}")
+        url = self.message_url + f"?user_id={self.users[1].id}&representation=compact"
+        self.client.get(url, **self.bearers[0])
+
+        # version (2), messages, attachments, archive segments and the users side-table
+        with self.assertNumQueries(6):
+            self.client.get(url, **self.bearers[0])
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestMessageArchive(ConversationTestCase):
+
+    def page_through(self, page_size):
+        ids = []
+        url = self.message_url + f"?user_id={self.users[1].id}&page_size={page_size}"
+        while url:
+            result = self.client.get(url, **self.bearers[0]).json()
+            ids += [row["id"] for row in result["results"]]
+            url = result["next"]
+        return ids
+
+    def test_archive_and_read_back(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+        from io import StringIO
+        from .models import MessageArchive
+
+        upload = GenericFileUpload.objects.create(
+            file_upload=SimpleUploadedFile("front1.png", create_image(None, "avatar.png").getvalue()))
+        messages = [self.send(i % 2, (i + 1) % 2, f"message {i}") for i in range(5)]
+        attachment = MessageAttachment.objects.create(message_id=messages[0]["id"], attachment=upload, caption="old")
+
+        old = timezone.now() - timedelta(days=450)
+        for index, message in enumerate(messages[:3]):
+            Message.objects.filter(id=message["id"]).update(created_at=old + timedelta(minutes=index))
+        ids = self.page_through(10)
+        self.assertEqual(ids, [message["id"] for message in reversed(messages)])
+
+        call_command("archive_messages", stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(MessageArchive.objects.get().message_count, 3)
+        # archived messages are not counted as unread anymore
+        self.assertEqual(self.client.get("/message/unread-count", **self.bearers[1]).json(), {"total": 1})
+
+        # listing pages through the table into the archive
+        self.assertEqual(self.page_through(2), ids)
+        self.assertEqual(self.page_through(10), ids)
+
+        result = self.client.get(self.message_url + f"?user_id={self.users[1].id}", **self.bearers[0]).json()
+        archived = result["results"][-1]
+        self.assertEqual(archived["message"], "message 0")
+        self.assertEqual(archived["sender"]["user"]["username"], "first")
+        self.assertEqual(archived["message_attachments"][0]["caption"], "old")
+        self.assertEqual(archived["message_attachments"][0]["id"], attachment.id)
+        self.assertEqual(archived["message_attachments"][0]["attachment"]["id"], upload.id)
+
+        # the search index rows are gone with the table rows
+        search = self.client.get("/message/search", data={"q": "message"}, **self.bearers[0]).json()
+        self.assertEqual(sorted(row["id"] for row in search["results"]), sorted(ids[:2]))
+
+        # paging back towards newer messages from inside the archive
+        cursor = self.client.get(self.message_url + f"?user_id={self.users[1].id}&page_size=4",
+                                 **self.bearers[0]).json()["next"]
+        result = self.client.get(cursor.replace("before=", "after="), **self.bearers[0]).json()
+        self.assertEqual([row["id"] for row in result["results"]], ids[:3])
+
+        # running again merges into the same segment
+        Message.objects.filter(id=messages[3]["id"]).update(created_at=old + timedelta(minutes=5))
+        call_command("archive_messages", stdout=StringIO())
+        self.assertEqual(MessageArchive.objects.get().message_count, 4)
+        self.assertEqual(self.page_through(3), ids)
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestFastSerializers(ConversationTestCase):
+    file_upload_url = "/message/file-upload"
+
+    def setUp(self):
+        super().setUp()
+        from django.contrib.auth.models import Group
+        from django.utils import timezone
+        from user_control.models import CustomUser, UserProfile
+        from .thumbnails import generate_thumbnail
+
+        image = SimpleUploadedFile("face.png", create_image(None, "face.png").getvalue(), content_type="image/png")
+        image = self.client.post(self.file_upload_url, data={"file_upload": image}).json()
+        generate_thumbnail(image["blob"])
+        document = SimpleUploadedFile("notes.txt", b"some notes", content_type="text/plain")
+        document = self.client.post(self.file_upload_url, data={"file_upload": document}).json()
+
+        UserProfile.objects.filter(user=self.users[0]).update(profile_picture_id=image["id"])
+        self.users[1].groups.add(Group.objects.create(name="testers"))
+        CustomUser.objects.filter(id=self.users[1].id).update(last_login=None)
+
+        messages = [self.send(index % 2, (index + 1) % 2, f"message {index}") for index in range(4)]
+        MessageAttachment.objects.create(message_id=messages[0]["id"], attachment_id=image["id"], caption="face")
+        MessageAttachment.objects.create(message_id=messages[0]["id"], attachment_id=document["id"])
+        Message.objects.filter(id=messages[1]["id"]).update(message=None, updated_at=timezone.now())
+
+    def get_both(self, url):
+        with override_settings(FAST_SERIALIZERS_ENABLED=False):
+            slow = self.client.get(url, **self.bearers[0])
+        fast = self.client.get(url, **self.bearers[0])
+        self.assertEqual(slow.status_code, 200)
+        return slow.content, fast.content
+
+    def test_listing_parity(self):
+        url = self.message_url + f"?user_id={self.users[1].id}"
+        for query in ("", "&page_size=2", "&page=1", "&fields=id,receiver,message_attachments"):
+            slow, fast = self.get_both(url + query)
+            self.assertEqual(fast, slow)
+        self.assertIn(b".thumb.webp", fast)
+
+        slow, fast = self.get_both(self.message_url)
+        self.assertEqual(fast, slow)
+
+    def test_serializer_parity(self):
+        from rest_framework.renderers import JSONRenderer
+        from .fast_serializers import FastMessageAttachmentSerializer, FastMessageSerializer
+        from .serializers import MessageAttachmentSerializer, MessageSerializer
+        from .views import MessageView
+
+        render = JSONRenderer().render
+        messages = MessageView.queryset.order_by("id")
+        self.assertEqual(render(FastMessageSerializer(messages, many=True).data),
+                         render(MessageSerializer(messages, many=True).data))
+        self.assertEqual(render(FastMessageSerializer(messages[0]).data), render(MessageSerializer(messages[0]).data))
+
+        attachments = MessageAttachment.objects.all()
+        self.assertEqual(render(FastMessageAttachmentSerializer(attachments, many=True).data),
+                         render(MessageAttachmentSerializer(attachments, many=True).data))
+
+    def test_benchmark_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("bench_serializers", "--rounds", "2", stdout=out)
+        self.assertIn("messages", out.getvalue())
+        self.assertIn("profiles", out.getvalue())
+
+
+class TestNotificationDispatcher(APITestCase):
+
+    class FakeSession:
+
+        def __init__(self, failures=0, status_code=200):
+            self.failures = failures
+            self.status_code = status_code
+            self.posts = []
+
+        def post(self, url, data, timeout=None):
+            import requests
+            from types import SimpleNamespace
+
+            if self.failures:
+                self.failures -= 1
+                raise requests.ConnectionError("socket server is down")
+            self.posts.append(json.loads(data))
+            return SimpleNamespace(status_code=self.status_code)
+
+    def get_dispatcher(self, session, **kwargs):
+        from .notifications import NotificationDispatcher
+        return NotificationDispatcher("http://socket", session=session, backoff=0, **kwargs)
+
+    def test_events_are_batched(self):
+        session = self.FakeSession()
+        dispatcher = self.get_dispatcher(session, batch_size=10)
+
+        dispatcher.enqueue_many([{"message": i} for i in range(3)])
+        dispatcher.start()
+        dispatcher.flush()
+
+        self.assertEqual(session.posts, [{"version": 2, "events": [{"message": 0}, {"message": 1}, {"message": 2}]}])
+        self.assertEqual(dispatcher.stats["sent"], 3)
+
+    def test_worker_survives_errors(self):
+        session = self.FakeSession()
+        dispatcher = self.get_dispatcher(session)
+
+        dispatcher.enqueue({"message": object()})
+        with self.assertLogs("message_control.notifications", "ERROR"):
+            dispatcher.start()
+            dispatcher.flush()
+        dispatcher.enqueue({"message": "next"})
+        dispatcher.flush()
+
+        self.assertEqual(session.posts, [{"message": "next"}])
+        self.assertEqual(dispatcher.stats["failed"], 1)
+        self.assertEqual(dispatcher.stats["sent"], 1)
+
+    def test_rejected_events_are_not_sent(self):
+        session = self.FakeSession(status_code=400)
+        dispatcher = self.get_dispatcher(session)
+
+        dispatcher.enqueue({"message": "rejected"})
+        dispatcher.start()
+        dispatcher.flush()
+
+        # not retried either
+        self.assertEqual(session.posts, [{"message": "rejected"}])
+        self.assertEqual(dispatcher.stats["sent"], 0)
+        self.assertEqual(dispatcher.stats["failed"], 1)
+
+    def test_retry_and_overflow(self):
+        session = self.FakeSession(failures=1)
+        dispatcher = self.get_dispatcher(session, max_queue_size=1)
+
+        self.assertTrue(dispatcher.enqueue({"message": "kept"}))
+        self.assertFalse(dispatcher.enqueue({"message": "dropped"}))
+        dispatcher.start()
+        dispatcher.flush()
+
+        self.assertEqual(session.posts, [{"message": "kept"}])
+        self.assertEqual(dispatcher.stats["dropped"], 1)
+        self.assertEqual(dispatcher.stats["retried"], 1)
+
+
+class TestRealtime(APITestCase):
+    login_url = "/user/login"
+
+    def setUp(self):
+        from user_control.models import CustomUser
+
+        payload = {
+            "username": "receiver",
+            "password": "receiver123",
+            "email": "receiver@yahoo.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        response = self.client.post(self.login_url, data=payload)
+        self.token = response.json()["access"]
+
+    def connect(self, query_string, events):
+        import asyncio
+        from .realtime import websocket_application, publish
+
+        sent = []
+
+        async def run():
+            incoming = asyncio.Queue()
+            await incoming.put({"type": "websocket.connect"})
+
+            async def receive():
+                return await incoming.get()
+
+            async def send(message):
+                sent.append(message)
+                if message["type"] == "websocket.accept":
+                    # publish from a worker thread, like a sync view would
+                    loop = asyncio.get_event_loop()
+                    for event in events:
+                        await loop.run_in_executor(None, publish, self.user.id, event)
+                elif message["type"] == "websocket.send":
+                    await incoming.put({"type": "websocket.disconnect"})
+
+            scope = {"type": "websocket", "path": "/ws", "query_string": query_string.encode()}
+            await asyncio.wait_for(websocket_application(scope, receive, send), timeout=5)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        return sent
+
+    def test_authenticated_socket_receives_events(self):
+        sent = self.connect(f"token={self.token}", [{"type": "message.created", "data": {"id": 1}}])
+
+        self.assertEqual(sent[0]["type"], "websocket.accept")
+        self.assertEqual(json.loads(sent[1]["text"]), {"type": "message.created", "data": {"id": 1}})
+
+    def test_invalid_token_is_rejected(self):
+        sent = self.connect("token=invalid", [])
+
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4401}])
+
+    def test_udp_fanout_between_workers(self):
+        import threading
+        from .realtime import UDPFanout
+
+        class Registry:
+            def __init__(self):
+                self.events = []
+                self.received = threading.Event()
+
+            def deliver(self, user_id, event):
+                self.events.append((user_id, event))
+                self.received.set()
+
+        local = Registry()
+        publisher = UDPFanout(local)
+        registry = Registry()
+        subscriber = UDPFanout(registry)
+        subscriber.start()
+        publisher.peers = [subscriber.address]
+
+        publisher.publish(7, {"type": "message.created"})
+
+        self.assertTrue(registry.received.wait(5))
+        self.assertEqual(registry.events, [(7, {"type": "message.created"})])
+        # the publishing worker's own websockets get it too
+        self.assertEqual(local.events, [(7, {"type": "message.created"})])
+
+        # oversized events go out as a reference
+        registry.received.clear()
+        publisher.publish(7, {"type": "message.created", "data": {"id": 3, "message": "x" * 70000}})
+        self.assertTrue(registry.received.wait(5))
+        self.assertEqual(registry.events[-1], (7, {"type": "message.created", "truncated": True, "data": {"id": 3}}))
+
+        # send errors are logged, not raised
+        publisher.peers = [("127.0.0.1", 0)]
+        with self.assertLogs("message_control.realtime", "WARNING"):
+            publisher.publish(7, {"type": "message.created"})
+
+    def test_udp_fanout_workers(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from .realtime import ConnectionRegistry, UDPFanout
+
+        # ports above the ephemeral range used by the other tests
+        fanout = UDPFanout(ConnectionRegistry(), port=29001, workers=3, worker_index=1)
+        self.addCleanup(fanout.socket.close)
+        self.assertEqual(fanout.address, ("127.0.0.1", 29002))
+        self.assertEqual(fanout.peers, [("127.0.0.1", 29001), ("127.0.0.1", 29003)])
+
+        with self.assertRaises(ImproperlyConfigured):
+            UDPFanout(ConnectionRegistry(), port=29001, workers=2, worker_index=2)
+
+    def test_udp_fanout_drops_unsigned_datagrams(self):
+        import socket
+        from .realtime import ConnectionRegistry, UDPFanout
+
+        class Registry:
+            events = []
+
+            def deliver(self, user_id, event):
+                self.events.append((user_id, event))
+
+        subscriber = UDPFanout(Registry(), secret="one")
+        publisher = UDPFanout(ConnectionRegistry(), secret="other")
+        publisher.peers = [subscriber.address]
+        with self.assertLogs("message_control.realtime", "WARNING"):
+            publisher.publish(7, {"type": "message.created"})
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sender.sendto(json.dumps({"user_id": 7, "event": {}}).encode(), subscriber.address)
+            sender.close()
+            subscriber.socket.settimeout(5)
+            with self.assertRaises(socket.timeout):
+                # run the listener until the socket runs dry
+                subscriber.listen()
+        self.assertEqual(Registry.events, [])
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestBulkMessages(ConversationTestCase):
+    bulk_url = "/message/bulk"
+
+    def test_bulk_send(self):
+        upload = GenericFileUpload.objects.create(
+            file_upload=SimpleUploadedFile('front1.png', create_image(None, 'avatar.png').getvalue()))
+
+        payload = {
+            "messages": [
+                {"receiver_id": self.users[1].id, "message": "first"},
+                {"receiver_id": self.users[2].id, "message": "second",
+                 "attachments": [{"attachment_id": upload.id, "caption": "nice stuff"}]},
+                {"receiver_id": self.users[1].id, "message": "third"},
+            ]
+        }
+        response = self.client.post(self.bulk_url, data=json.dumps(payload),
+                                    content_type='application/json', **self.bearers[0])
+        result = response.json()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row["message"] for row in result], ["first", "second", "third"])
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(result[1]["message_attachments"][0]["caption"], "nice stuff")
+        self.assertEqual(result[0]["receiver"]["user"]["username"], "second")
+
+        response = self.client.get(self.inbox_url, **self.bearers[1])
+        conversation = response.json()["results"][0]
+        self.assertEqual(conversation["unread_count"], 2)
+        self.assertEqual(conversation["last_message_preview"], "third")
+
+    def test_bulk_send_is_validated_together(self):
+        payload = {
+            "messages": [
+                {"receiver_id": self.users[1].id, "message": "first"},
+                {"receiver_id": 999, "message": "unknown"},
+            ]
+        }
+        response = self.client.post(self.bulk_url, data=json.dumps(payload),
+                                    content_type='application/json', **self.bearers[0])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Message.objects.count(), 0)
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestChunkedUpload(APITestCase):
+    upload_url = "/message/uploads"
+    login_url = "/user/login"
+
+    def setUp(self):
+        from user_control.models import CustomUser
+
+        payload = {
+            "username": "uploader",
+            "password": "uploader123",
+            "email": "uploader@yahoo.com"
+        }
+        CustomUser.objects.create_user(**payload)
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            'HTTP_AUTHORIZATION': 'Bearer {}'.format(response.json()['access'])}
+
+    def put_part(self, upload_id, part_number, content):
+        return self.client.put(f"{self.upload_url}/{upload_id}/parts/{part_number}", data=content,
+                               content_type="application/octet-stream", **self.bearer)
+
+    def test_chunked_upload(self):
+        response = self.client.post(self.upload_url, data={"file_name": "video.mp4"}, **self.bearer)
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()["id"]
+
+        # parts can arrive in any order and be retried
+        self.put_part(upload_id, 2, b"second part")
+        self.put_part(upload_id, 1, b"broken")
+        response = self.put_part(upload_id, 1, b"first part, ")
+        self.assertEqual(response.json(), {"part_number": 1, "size": 12})
+
+        response = self.client.post(f"{self.upload_url}/{upload_id}/complete", **self.bearer)
+        self.assertEqual(response.status_code, 201)
+
+        upload = GenericFileUpload.objects.get(id=response.json()["id"])
+        with upload.file_upload.open("rb") as stored:
+            self.assertEqual(stored.read(), b"first part, second part")
+
+        response = self.client.get(f"{self.upload_url}/{upload_id}", **self.bearer)
+        self.assertEqual(response.status_code, 404)
+
+    def test_abort(self):
+        response = self.client.post(self.upload_url, data={"file_name": "video.mp4"}, **self.bearer)
+        upload_id = response.json()["id"]
+        self.put_part(upload_id, 1, b"first part")
+
+        response = self.client.delete(f"{self.upload_url}/{upload_id}", **self.bearer)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(GenericFileUpload.objects.count(), 0)
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestPresignedUpload(APITestCase):
+    file_upload_url = "/message/file-upload"
+
+    def test_presigned_upload_and_download(self):
+        response = self.client.post(self.file_upload_url + "/presign",
+                                    data={"file_name": "notes.txt", "content_type": "text/plain"})
+        self.assertEqual(response.status_code, 201)
+        presigned = response.json()
+
+        # not uploaded yet
+        response = self.client.post(self.file_upload_url + "/confirm", data={"token": presigned["token"]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.put(presigned["url"], data=b"hello world", content_type="text/plain")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(self.file_upload_url + "/confirm", data={"token": presigned["token"]})
+        result = response.json()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(result["size"], 11)
+        self.assertEqual(result["content_type"], "text/plain")
+
+        response = self.client.get(self.file_upload_url + f"/{result['id']}/download-url")
+        response = self.client.get(response.json()["url"])
+        self.assertEqual(b"".join(response.streaming_content), b"hello world")
+
+        # upload urls cannot be used to read
+        response = self.client.get(presigned["url"])
+        self.assertEqual(response.status_code, 404)
+
+    def test_declared_checksum(self):
+        import hashlib
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import StoredBlob
+
+        content = b"hello world"
+        sha256 = hashlib.sha256(content).hexdigest()
+        presigned = self.client.post(self.file_upload_url + "/presign", data={
+            "file_name": "notes.txt", "sha256": sha256, "size": len(content)}).json()
+        self.assertFalse(presigned["exists"])
+        self.assertIn("x-amz-checksum-sha256", presigned["headers"])
+
+        # the storage refuses content that does not match
+        response = self.client.put(presigned["url"], data=b"something else", content_type="text/plain")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.file_upload_url + "/confirm", data={"token": presigned["token"]})
+        self.assertEqual(response.status_code, 400)
+
+        self.client.put(presigned["url"], data=content, content_type="text/plain")
+        result = self.client.post(self.file_upload_url + "/confirm", data={"token": presigned["token"]}).json()
+        self.assertEqual(StoredBlob.objects.get(id=result["blob"]).sha256, sha256)
+
+        # without a checksum the upload is deduplicated later, off the request path
+        presigned = self.client.post(self.file_upload_url + "/presign", data={"file_name": "copy.txt"}).json()
+        self.client.put(presigned["url"], data=content, content_type="text/plain")
+        copy = self.client.post(self.file_upload_url + "/confirm", data={"token": presigned["token"]}).json()
+        self.assertIsNone(copy["blob"])
+
+        call_command("dedupe_uploads", stdout=StringIO())
+        self.assertEqual(GenericFileUpload.objects.get(id=copy["id"]).blob_id, result["blob"])
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT)
+class TestUploadDeduplication(APITestCase):
+    file_upload_url = "/message/file-upload"
+    content = b"the same bytes, forwarded again and again"
+
+    def upload(self, name):
+        return self.client.post(self.file_upload_url, data={"file_upload": SimpleUploadedFile(name, self.content)})
+
+    def test_identical_content_is_stored_once(self):
+        import hashlib
+        from .models import StoredBlob
+
+        first = self.upload("first.txt").json()
+        second = self.upload("second.txt").json()
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(first["file_upload"], second["file_upload"])
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+
+        # a hash hit skips the upload
+        response = self.client.post(self.file_upload_url + "/presign", data={
+            "file_name": "third.txt", "sha256": blob.sha256, "size": len(self.content)})
+        self.assertTrue(response.json()["exists"])
+        third = response.json()["upload"]
+        self.assertEqual(third["blob"], blob.id)
+
+        response = self.client.post(self.file_upload_url + "/presign", data={
+            "file_name": "third.txt", "sha256": blob.sha256, "size": 1})
+        self.assertFalse(response.json()["exists"])
+
+        for upload in (first, second):
+            self.client.delete(self.file_upload_url + f"/{upload['id']}")
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+
+        self.client.delete(self.file_upload_url + f"/{third['id']}")
+        self.assertFalse(StoredBlob.objects.exists())
+
+
+@override_settings(DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage", MEDIA_ROOT=MEDIA_ROOT,
+                   THUMBNAIL_SIZE=64)
+class TestThumbnails(APITestCase):
+    file_upload_url = "/message/file-upload"
+
+    def test_image_thumbnail(self):
+        from django.core.files.storage import default_storage
+        from .thumbnails import generate_thumbnail
+
+        image = SimpleUploadedFile("wide.png", create_image(None, "wide.png", size=(400, 200)).getvalue(),
+                                   content_type="image/png")
+        result = self.client.post(self.file_upload_url, data={"file_upload": image}).json()
+        self.assertIsNone(result["thumbnail"])
+
+        # rendered by the worker pool once the upload is committed
+        self.assertTrue(generate_thumbnail(result["blob"]))
+        result = self.client.get(self.file_upload_url + f"/{result['id']}").json()
+        self.assertTrue(result["thumbnail"].endswith(".thumb.webp"))
+
+        upload = GenericFileUpload.objects.get(id=result["id"])
+        with default_storage.open(upload.blob.thumbnail.name, "rb") as file:
+            thumbnail = Image.open(file)
+            self.assertEqual(thumbnail.format, "WEBP")
+            self.assertEqual(thumbnail.size, (64, 32))
+
+    def test_other_files_are_skipped(self):
+        from .thumbnails import generate_thumbnail
+
+        document = SimpleUploadedFile("notes.txt", b"not an image", content_type="text/plain")
+        result = self.client.post(self.file_upload_url, data={"file_upload": document}).json()
+        self.assertFalse(generate_thumbnail(result["blob"]))
+        self.assertIsNone(result["thumbnail"])
@@ -0,0 +1,117 @@
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+from .models import StoredBlob
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_SUFFIX = ".thumb.webp"
+
+
+def is_image(content_type, name):
+    content_type = content_type or mimetypes.guess_type(name)[0] or ""
+    return content_type.startswith("image/")
+
+
+def get_thumbnail_name(name):
+    return os.path.splitext(name)[0] + THUMBNAIL_SUFFIX
+
+
+def render_thumbnail(file, size):
+    image = Image.open(file)
+    # lets JPEG decode at a reduced scale instead of full resolution
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    output = BytesIO()
+    image.save(output, THUMBNAIL_FORMAT, quality=settings.THUMBNAIL_QUALITY, method=4)
+    return output.getvalue()
+
+
+def generate_thumbnail(blob_id):
+    """
+    Renders the preview of an image blob and stores it next to the
+    original. Returns False for blobs that are not decodable images.
+    """
+    blob = StoredBlob.objects.filter(id=blob_id).first()
+    if blob is None or blob.thumbnail:
+        return bool(blob)
+
+    try:
+        with default_storage.open(blob.file.name, "rb") as file:
+            content = render_thumbnail(file, settings.THUMBNAIL_SIZE)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Unable to render a thumbnail for %s", blob.file.name)
+        return False
+
+    name = default_storage.save(get_thumbnail_name(blob.file.name), ContentFile(content))
+    if not StoredBlob.objects.filter(id=blob_id, thumbnail="").update(thumbnail=name):
+        # deleted or rendered by another worker meanwhile
+        default_storage.delete(name)
+        return True
+    touch_blob_users(blob_id)
+    return True
+
+
+def touch_blob_users(blob_id):
+    """
+    Changes the version of everything showing the blob, so clients holding
+    a copy without the thumbnail fetch it again: the conversations and the
+    sync feed of messages attaching it, and the profiles using it.
+    """
+    from django.utils import timezone
+    from user_control.models import UserProfile
+    from .changes import log_message_changes
+    from .models import Conversation, Message
+
+    messages = list(Message.objects.filter(message_attachments__attachment__blob_id=blob_id).distinct())
+    log_message_changes(messages)
+    Conversation.objects.filter(key__in={message.conversation_key for message in messages}).update(
+        updated_at=timezone.now())
+    for profile in UserProfile.objects.filter(profile_picture__blob_id=blob_id).select_related("user"):
+        profile.save(update_fields=["updated_at"])
+
+
+def run_thumbnail(blob_id):
+    try:
+        generate_thumbnail(blob_id)
+    except Exception:
+        logger.exception("Thumbnail generation failed for blob %s", blob_id)
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+    return _executor
+
+
+def schedule_thumbnail(blob_id):
+    """
+    Queues the thumbnail once the current transaction commits, or renders
+    it in place when THUMBNAIL_WORKERS is 0.
+    """
+    if settings.THUMBNAIL_WORKERS <= 0:
+        transaction.on_commit(lambda: generate_thumbnail(blob_id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_thumbnail, blob_id))
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from chatapi.checks import is_local_cache
+from .models import Message
+
+
+def pair_key(receiver_id, sender_id):
+    return f"unread:{receiver_id}:{sender_id}"
+
+
+def total_key(receiver_id):
+    return f"unread-total:{receiver_id}"
+
+
+def get_unread_counts(receiver_id, sender_ids):
+    """
+    Number of unread messages each sender has sent to receiver_id. Counters
+    come from the shared cache, the missing ones are counted in a single
+    grouped query and cached. With a per-process cache (LocMemCache) they
+    are always counted, reconcile_unread could not fix the workers' copies.
+    """
+    sender_ids = set(sender_ids)
+    if not receiver_id or not sender_ids:
+        return {}
+    if is_local_cache():
+        # counters adjusted in one process would be wrong in the others
+        return count_unread(receiver_id, sender_ids)
+
+    keys = {pair_key(receiver_id, sender_id): sender_id for sender_id in sender_ids}
+    counts = {keys[key]: count for key, count in cache.get_many(keys).items()}
+    missing = sender_ids - set(counts)
+    if missing:
+        loaded = count_unread(receiver_id, missing)
+        cache.set_many({pair_key(receiver_id, sender_id): count for sender_id, count in loaded.items()},
+                       timeout=settings.UNREAD_CACHE_TIMEOUT)
+        counts.update(loaded)
+    return counts
+
+
+def count_unread(receiver_id, sender_ids):
+    counts = dict.fromkeys(sender_ids, 0)
+    rows = Message.objects.filter(
+        receiver_id=receiver_id, sender_id__in=sender_ids, is_read=False
+    ).values("sender_id").annotate(count=Count("id")).order_by()
+    counts.update({row["sender_id"]: row["count"] for row in rows})
+    return counts
+
+
+def get_unread_total(receiver_id):
+    if is_local_cache():
+        return Message.objects.filter(receiver_id=receiver_id, is_read=False).count()
+    total = cache.get(total_key(receiver_id))
+    if total is None:
+        total = Message.objects.filter(receiver_id=receiver_id, is_read=False).count()
+        cache.set(total_key(receiver_id), total, timeout=settings.UNREAD_CACHE_TIMEOUT)
+    return total
+
+
+def add_unread(receiver_id, sender_id, count):
+    # only counters already cached are bumped, the others load on next read
+    if is_local_cache():
+        return
+    for key in (pair_key(receiver_id, sender_id), total_key(receiver_id)):
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            pass
+
+
+def set_pair_counts(counts):
+    """
+    Stores exact counters, {(receiver_id, sender_id): count}, computed from
+    the message table. The receivers' totals are dropped and recounted on
+    their next read.
+    """
+    if is_local_cache():
+        return
+    cache.set_many({pair_key(*pair): count for pair, count in counts.items()},
+                   timeout=settings.UNREAD_CACHE_TIMEOUT)
+    cache.delete_many([total_key(receiver_id) for receiver_id, _ in counts])
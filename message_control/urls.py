@@ -1,13 +1,25 @@
 from rest_framework.routers import DefaultRouter
-from .views import GenericFileUploadView, MessageView, ReadMultipleMessages
+from .views import (
+    GenericFileUploadView, MessageView, ReadMultipleMessages, InboxView, BulkMessageView, ChunkedUploadView,
+    LocalStorageView, UnreadCountView, ReadConversationView, SyncView,
+    MessageSearchView
+)
 from django.urls import path, include
 
 router = DefaultRouter(trailing_slash=False)
 
 router.register("file-upload", GenericFileUploadView)
 router.register("message", MessageView)
+router.register("uploads", ChunkedUploadView, basename="uploads")
 
 urlpatterns = [
     path("", include(router.urls)),
     path("read-messages", ReadMultipleMessages.as_view()),
+    path("read-conversation", ReadConversationView.as_view()),
+    path("inbox", InboxView.as_view()),
+    path("unread-count", UnreadCountView.as_view()),
+    path("sync", SyncView.as_view()),
+    path("search", MessageSearchView.as_view()),
+    path("bulk", BulkMessageView.as_view()),
+    path("storage/<str:token>", LocalStorageView.as_view(), name="local-storage"),
 ]
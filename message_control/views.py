@@ -1,52 +1,313 @@
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ViewSet
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.views import APIView
-from .serializers import GenericFileUpload, GenericFileUploadSerializer, Message, MessageAttachment, MessageSerializer
+from rest_framework.generics import ListAPIView
+from .serializers import (
+    GenericFileUpload, GenericFileUploadSerializer, Message, MessageAttachment, MessageSerializer,
+    Conversation, ConversationSerializer, BulkMessageSerializer, UploadSessionSerializer,
+    ReadConversationSerializer, MessageSearchSerializer, CompactMessageSerializer
+)
+from .models import Change, UploadSession, UploadPart
+from .changes import log_message_changes, log_read
+from .archive import ArchivedMessagePagination
+from .fast_serializers import FastMessageSerializer
+from .blobs import acquire_blob, create_upload, register_stored_file
+from .conversations import record_message, record_messages, refresh_conversations, split_key
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from chatapi.conditional import ConditionalGetMixin
 from chatapi.custom_methods import IsAuthenticatedCustom
+from chatapi.storage_backends import ChecksumMismatch, get_sha256_checksum
+from chatapi.pagination import KeysetPagination
+from chatapi.representation import COMPACT, get_representation, get_sparse_fields
 from rest_framework.response import Response
+from django.db import connection, transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.core import signing
+from django.http import FileResponse
+from io import BytesIO
+import re
+import tempfile
+from datetime import timedelta
 from django.db.models import Q
+from django.utils import timezone
 from django.conf import settings
-import requests
-import json
-
-
-def handleRequest(serializerData):
-    notification = {
-        "message": serializerData.data.get("message"),
-        "from": serializerData.data.get("sender"),
-        "receiver": serializerData.data.get("receiver").get("id")
-    }
-
-    headers = {
-        'Content-Type': 'application/json',
-    }
-    try:
-        requests.post(settings.SOCKET_SERVER, json.dumps(
-            notification), headers=headers)
-    except Exception as e:
-        pass
+from .notifications import notify
+from .unread import get_unread_total
+from .search import MessageSearchPagination, index_messages, search_messages, tokenize
+from .realtime import publish
+from user_control.presence import get_presence_window
+
+
+def handleRequest(data, event="message.created"):
+    return handleRequests([data], event)
+
+
+def handleRequests(items, event="message.created"):
+    notifications = []
+    for data in items:
+        notification = {
+            "message": data.get("message"),
+            "from": data.get("sender"),
+            "receiver": data.get("receiver").get("id")
+        }
+        publish(notification["receiver"], {"type": event, "data": data})
+        notifications.append(notification)
+
+    notify(*notifications)
     return True
 
 
 class GenericFileUploadView(ModelViewSet):
-    queryset = GenericFileUpload.objects.all()
+    queryset = GenericFileUpload.objects.select_related("blob")
     serializer_class = GenericFileUploadSerializer
+    confirm_salt = "message_control.views.GenericFileUploadView.confirm"
+
+    @action(detail=False, methods=["post"])
+    def presign(self, request):
+        """
+        Issues a short-lived URL the client uploads the file to directly,
+        and a token to register it with `confirm` afterwards. Clients that
+        send the file's sha256 and size skip the upload when the content is
+        already stored, otherwise the storage checks the upload against it.
+        """
+        file_name = request.data.get("file_name", None)
+        if not file_name:
+            raise ValidationError({"file_name": "This field is required."})
+
+        content_type = request.data.get("content_type", "") or ""
+        sha256 = (request.data.get("sha256", "") or "").lower()
+        if sha256 and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise ValidationError({"sha256": "Expected a hex encoded SHA-256 digest."})
+        size = request.data.get("size", None)
+        if sha256 and size is not None:
+            blob = acquire_blob(sha256, size)
+            if blob is not None:
+                upload = create_upload(blob, content_type)
+                return Response({"exists": True, "upload": self.get_serializer(upload).data}, status=201)
+
+        name = default_storage.get_available_name(default_storage.generate_filename(file_name))
+        url = default_storage.get_presigned_upload_url(
+            name, settings.PRESIGNED_URL_EXPIRY, content_type, sha256=sha256 or None)
+        headers = {"Content-Type": content_type} if content_type else {}
+        if sha256:
+            headers["x-amz-checksum-sha256"] = get_sha256_checksum(sha256)
+
+        return Response({
+            "exists": False,
+            "url": request.build_absolute_uri(url),
+            "method": "PUT",
+            "headers": headers,
+            "expires_in": settings.PRESIGNED_URL_EXPIRY,
+            "token": signing.dumps({"name": name, "content_type": content_type, "sha256": sha256 or None},
+                                   salt=self.confirm_salt),
+        }, status=201)
+
+    @action(detail=False, methods=["post"])
+    def confirm(self, request):
+        try:
+            data = signing.loads(request.data.get("token", ""), salt=self.confirm_salt,
+                                 max_age=settings.PRESIGNED_CONFIRM_MAX_AGE)
+        except signing.BadSignature:
+            raise ValidationError({"token": "Invalid or expired upload token."})
+
+        if not default_storage.exists(data["name"]):
+            raise ValidationError({"token": "The file has not been uploaded."})
+
+        upload = register_stored_file(data["name"], data["content_type"], data.get("sha256", None))
+        return Response(self.get_serializer(upload).data, status=201)
+
+    @action(detail=True, methods=["get"], url_path="download-url")
+    def download_url(self, request, pk=None):
+        upload = self.get_object()
+        url = default_storage.get_presigned_download_url(upload.file_upload.name, settings.PRESIGNED_URL_EXPIRY)
+        return Response({"url": request.build_absolute_uri(url), "expires_in": settings.PRESIGNED_URL_EXPIRY})
+
+
+class LocalStorageView(APIView):
+    """
+    Target of the presigned URLs issued by LocalMediaStorage.
+    """
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get_grant(self, token, method):
+        grant = default_storage.verify_signed_url(token, method)
+        if not grant:
+            raise NotFound("Invalid or expired URL")
+        return grant
+
+    def get(self, request, token):
+        name = self.get_grant(token, "GET")["name"]
+        if not default_storage.exists(name):
+            raise NotFound("File not found")
+        return FileResponse(default_storage.open(name, "rb"))
+
+    def put(self, request, token):
+        grant = self.get_grant(token, "PUT")
+        try:
+            default_storage.write_stream(grant["name"], request.stream or BytesIO(), grant.get("sha256", None))
+        except ChecksumMismatch:
+            raise ValidationError({"sha256": "The content does not match the declared checksum."})
+        return Response(status=200)
+
+
+class ChunkedUploadView(ViewSet):
+    """
+    Resumable uploads: create a session, PUT each part as the raw request
+    body to parts/<number>, then complete. Parts are streamed into a
+    multipart upload on the storage backend.
+    """
+    permission_classes = (IsAuthenticatedCustom, )
+    serializer_class = UploadSessionSerializer
+
+    def get_session(self, pk):
+        try:
+            return UploadSession.objects.get(id=pk, user_id=self.request.user.id)
+        except (UploadSession.DoesNotExist, DjangoValidationError, ValueError):
+            raise NotFound("Upload not found")
+
+    def retrieve(self, request, pk=None):
+        return Response(self.serializer_class(self.get_session(pk)).data)
+
+    def create(self, request):
+        file_name = request.data.get("file_name", None)
+        if not file_name:
+            raise ValidationError({"file_name": "This field is required."})
+
+        name = default_storage.get_available_name(default_storage.generate_filename(file_name))
+        content_type = request.data.get("content_type", "") or ""
+        session = UploadSession.objects.create(
+            user_id=request.user.id, file_name=name, content_type=content_type,
+            upload_id=default_storage.create_multipart_upload(name, content_type))
 
+        data = self.serializer_class(session).data
+        data["part_size"] = settings.UPLOAD_PART_SIZE
+        return Response(data, status=201)
 
-class MessageView(ModelViewSet):
+    @action(detail=True, methods=["put"], url_path=r"parts/(?P<part_number>\d+)")
+    def upload_part(self, request, pk=None, part_number=None):
+        session = self.get_session(pk)
+        part_number = int(part_number)
+        if not 1 <= part_number <= 10000:
+            raise ValidationError({"part_number": "Part numbers range from 1 to 10000."})
+
+        if request.stream is None:
+            raise ValidationError({"part": "The request body is empty."})
+
+        # spool the body in chunks, never holding more than one part
+        with tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_SIZE) as content:
+            size = 0
+            for chunk in iter(lambda: request.stream.read(64 * 1024), b""):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_PART_SIZE:
+                    raise ValidationError({"part": "Part is too large."})
+                content.write(chunk)
+            content.seek(0)
+            etag = default_storage.upload_part(session.file_name, session.upload_id, part_number, content)
+
+        UploadPart.objects.update_or_create(
+            session=session, part_number=part_number, defaults={"etag": etag, "size": size})
+        return Response({"part_number": part_number, "size": size})
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk=None):
+        session = self.get_session(pk)
+        parts = list(session.parts.values_list("part_number", "etag"))
+        if not parts:
+            raise ValidationError({"parts": "No parts were uploaded."})
+
+        name = default_storage.complete_multipart_upload(session.file_name, session.upload_id, parts)
+        upload = register_stored_file(name, session.content_type)
+        session.delete()
+        return Response(GenericFileUploadSerializer(upload, context={"request": request}).data, status=201)
+
+    def destroy(self, request, pk=None):
+        session = self.get_session(pk)
+        default_storage.abort_multipart_upload(session.file_name, session.upload_id)
+        session.delete()
+        return Response(status=204)
+
+
+class MessageView(ConditionalGetMixin, ModelViewSet):
     queryset = Message.objects.select_related(
-        "sender", "receiver").prefetch_related("message_attachments")
+        "sender__user_profile__profile_picture__blob", "receiver__user_profile__profile_picture__blob"
+    ).prefetch_related(
+        "sender__groups", "sender__user_permissions", "receiver__groups", "receiver__user_permissions",
+        Prefetch("message_attachments", queryset=MessageAttachment.objects.select_related("attachment__blob")))
+    # compact listings only refer to users by id
+    compact_queryset = Message.objects.prefetch_related(
+        Prefetch("message_attachments", queryset=MessageAttachment.objects.select_related("attachment__blob")))
     serializer_class = MessageSerializer
     permission_classes = (IsAuthenticatedCustom, )
+    use_read_replica = True
+    pagination_class = ArchivedMessagePagination
+    conditional_actions = ("list", )
+
+    def is_compact(self):
+        return self.action == "list" and get_representation(self.request) == COMPACT
 
     def get_queryset(self):
         data = self.request.query_params.dict()
         user_id = data.get("user_id", None)
+        queryset = self.compact_queryset if self.is_compact() else self.queryset
 
         if user_id:
             active_user_id = self.request.user.id
-            return self.queryset.filter(Q(sender_id=user_id, receiver_id=active_user_id) | Q(
-                sender_id=active_user_id, receiver_id=user_id)).distinct()
-        return self.queryset
+            return queryset.filter(
+                conversation_key=Message.get_conversation_key(user_id, active_user_id))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.is_compact():
+            return CompactMessageSerializer
+        if self.action == "list" and settings.FAST_SERIALIZERS_ENABLED:
+            return FastMessageSerializer
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == "GET":
+            kwargs.setdefault("fields", get_sparse_fields(self.request))
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if self.is_compact():
+            from user_control.serializers import get_user_table
+
+            user_ids = {row[field] for row in response.data["results"]
+                        for field in ("sender", "receiver") if field in row}
+            response.data["users"] = get_user_table(
+                user_ids, self.get_serializer_context(), get_sparse_fields(request, "user_fields"))
+        return response
+
+    def get_archive_key(self):
+        user_id = self.request.query_params.get("user_id", None)
+        if not user_id:
+            return None
+        return Message.get_conversation_key(user_id, self.request.user.id)
+
+    def get_version(self, request):
+        user_id = request.query_params.get("user_id", None)
+        if not user_id:
+            # every message write and read goes to the change feed, the
+            # nested profiles' presence does not
+            version = {
+                "changes": Change.objects.order_by("-id").values_list("id", flat=True).first(),
+                "presence": get_presence_window(),
+            }
+            return version, None
+
+        # the conversation summary is touched by every write to its messages
+        conversation_key = Message.get_conversation_key(user_id, request.user.id)
+        conversation = Conversation.objects.filter(key=conversation_key).values_list("updated_at", flat=True).first()
+        users = list(get_user_model().objects.filter(id__in=split_key(conversation_key)).values_list(
+            "id", "updated_at", "is_online", "user_profile__updated_at").order_by("id"))
+
+        timestamps = [conversation] + [timestamp for user in users for timestamp in user[1:]]
+        return [conversation, users], max(filter(None, timestamps), default=None)
 
     def create(self, request, *args, **kwargs):
 
@@ -59,20 +320,24 @@ class MessageView(ModelViewSet):
         if str(request.user.id) != str(request.data.get("sender_id", None)):
             raise Exception("only sender can create a message")
 
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        record_message(serializer.instance)
+        log_message_changes([serializer.instance])
+        index_messages([serializer.instance])
+        data = serializer.data
 
         if attachments:
             MessageAttachment.objects.bulk_create([MessageAttachment(
-                **attachment, message_id=serializer.data["id"]) for attachment in attachments])
+                **attachment, message_id=data["id"]) for attachment in attachments])
 
-            message_data = self.get_queryset().get(id=serializer.data["id"])
-            return Response(self.serializer_class(message_data).data, status=201)
+            message_data = self.get_queryset().get(id=data["id"])
+            data = self.get_serializer(message_data).data
 
-        handleRequest(serializer)
+        handleRequest(data)
 
-        return Response(serializer.data, status=201)
+        return Response(data, status=201)
 
     def update(self, request, *args, **kwargs):
 
@@ -83,29 +348,318 @@ class MessageView(ModelViewSet):
         attachments = request.data.pop("attachments", None)
         instance = self.get_object()
 
-        serializer = self.serializer_class(
+        serializer = self.get_serializer(
             data=request.data, instance=instance, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        refresh_conversations([instance.conversation_key])
+        log_message_changes([instance])
+        index_messages([instance])
 
         MessageAttachment.objects.filter(message_id=instance.id).delete()
+        data = serializer.data
 
         if attachments:
             MessageAttachment.objects.bulk_create([MessageAttachment(
                 **attachment, message_id=instance.id) for attachment in attachments])
 
             message_data = self.get_object()
-            return Response(self.serializer_class(message_data).data, status=200)
+            data = self.get_serializer(message_data).data
+
+        handleRequest(data, "message.updated")
+
+        return Response(data, status=200)
+
+    def perform_destroy(self, instance):
+        log_message_changes([instance], deleted=True)
+        instance.delete()
+        refresh_conversations([instance.conversation_key])
+
+
+class BulkMessageView(APIView):
+    permission_classes = (IsAuthenticatedCustom, )
+    serializer_class = BulkMessageSerializer
+
+    def post(self, request):
+        items = request.data.get("messages", None) if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"messages": "A non-empty list of messages is required."})
+        if len(items) > settings.MESSAGE_BULK_MAX_SIZE:
+            raise ValidationError(
+                {"messages": f"At most {settings.MESSAGE_BULK_MAX_SIZE} messages can be sent at once."})
+
+        serializer = self.serializer_class(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
 
-        handleRequest(serializer)
+        sender_id = request.user.id
+        if any(item.get("sender_id", sender_id) != sender_id for item in items):
+            raise Exception("only sender can create a message")
+        self.validate_references(items)
+
+        with transaction.atomic():
+            messages = [Message(
+                sender_id=sender_id,
+                receiver_id=item["receiver_id"],
+                message=item.get("message", None),
+                conversation_key=Message.get_conversation_key(sender_id, item["receiver_id"]),
+            ) for item in items]
+            if connection.features.can_return_rows_from_bulk_insert:
+                Message.objects.bulk_create(messages)
+            else:
+                # the ids are needed below, other backends don't return them from a multi-row insert
+                for message in messages:
+                    message.save()
+
+            MessageAttachment.objects.bulk_create([
+                MessageAttachment(message_id=message.id, **attachment)
+                for message, item in zip(messages, items)
+                for attachment in item.get("attachments", [])
+            ])
+            record_messages(messages)
+            log_message_changes(messages)
+            index_messages(messages)
+
+        ids = [message.id for message in messages]
+        created = {message.id: message for message in MessageView.queryset.filter(id__in=ids)}
+        data = MessageSerializer(
+            [created[message_id] for message_id in ids], many=True, context={"request": request}).data
+
+        handleRequests(data)
+
+        return Response(data, status=201)
+
+    @staticmethod
+    def validate_references(items):
+        from user_control.models import CustomUser
 
-        return Response(serializer.data, status=200)
+        receiver_ids = {item["receiver_id"] for item in items}
+        found = set(CustomUser.objects.filter(id__in=receiver_ids).values_list("id", flat=True))
+        if receiver_ids - found:
+            raise ValidationError({"receiver_id": f"Unknown receivers: {sorted(receiver_ids - found)}"})
+
+        attachment_ids = {
+            attachment["attachment_id"] for item in items for attachment in item.get("attachments", [])}
+        if attachment_ids:
+            found = set(GenericFileUpload.objects.filter(id__in=attachment_ids).values_list("id", flat=True))
+            if attachment_ids - found:
+                raise ValidationError({"attachment_id": f"Unknown attachments: {sorted(attachment_ids - found)}"})
 
 
 class ReadMultipleMessages(APIView):
+    permission_classes = (IsAuthenticatedCustom, )
 
     def post(self, request):
         data = request.data.get("message_ids", None)
 
-        Message.objects.filter(id__in=data).update(is_read=True)
+        messages = Message.objects.filter(id__in=data, receiver_id=request.user.id, is_read=False)
+        read = list(messages.only("id", "sender_id", "receiver_id", "conversation_key"))
+        messages.update(is_read=True, updated_at=timezone.now())
+        refresh_conversations([message.conversation_key for message in read])
+        log_message_changes(read)
         return Response("success")
+
+
+class ReadConversationView(APIView):
+    """
+    Marks everything the other user sent up to a message (up_to_id) or a
+    time (up_to) as read, in one range UPDATE over the conversation index.
+    """
+    permission_classes = (IsAuthenticatedCustom, )
+
+    def post(self, request):
+        serializer = ReadConversationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        conversation_key = Message.get_conversation_key(request.user.id, data["user_id"])
+        messages = Message.objects.filter(conversation_key=conversation_key)
+        if "up_to_id" in data:
+            up_to = messages.filter(id=data["up_to_id"]).values_list("created_at", flat=True).first()
+            if up_to is None:
+                raise NotFound("Message not found in this conversation")
+            messages = messages.filter(Q(created_at__lt=up_to) | Q(created_at=up_to, id__lte=data["up_to_id"]))
+        else:
+            messages = messages.filter(created_at__lte=data["up_to"])
+
+        updated = messages.filter(receiver_id=request.user.id, is_read=False).update(
+            is_read=True, updated_at=timezone.now())
+        if updated:
+            refresh_conversations([conversation_key])
+            log_read(request.user.id, data["user_id"], conversation_key,
+                     data.get("up_to_id", None), data.get("up_to", None))
+            publish(data["user_id"], {"type": "message.read", "data": {
+                "reader": request.user.id,
+                "conversation_key": conversation_key,
+                "up_to_id": data.get("up_to_id", None),
+                "up_to": data.get("up_to", None),
+            }})
+
+        return Response({"updated": updated})
+
+
+class SyncView(APIView):
+    """
+    Changes since a sync token: new and edited messages, deleted ones as
+    tombstones, read receipts and profile updates, ordered by sequence.
+    Without a token only the current position is returned, clients take it
+    before a full fetch and resume from it afterwards.
+
+    Sequence numbers are taken at insert time, a transaction can commit a
+    lower one after a higher one was served. Changes younger than
+    SYNC_SETTLE_SECONDS are therefore held back, the page stops at the
+    first of them.
+    """
+    permission_classes = (IsAuthenticatedCustom, )
+    token_salt = "message_control.views.SyncView"
+    default_limit = 100
+    max_limit = 500
+
+    def get_token(self, user_id, seq):
+        return signing.dumps({"user": user_id, "seq": seq}, salt=self.token_salt)
+
+    def get_seq(self, request):
+        try:
+            data = signing.loads(request.query_params["since"], salt=self.token_salt,
+                                 max_age=settings.SYNC_RETENTION_DAYS * 24 * 60 * 60)
+        except signing.SignatureExpired:
+            return None
+        except signing.BadSignature:
+            raise ValidationError({"since": "Invalid sync token."})
+        if data["user"] != request.user.id:
+            raise ValidationError({"since": "Invalid sync token."})
+        return data["seq"]
+
+    def get_limit(self, request):
+        try:
+            return min(max(int(request.query_params.get("limit", self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            return self.default_limit
+
+    def get(self, request):
+        user_id = request.user.id
+        changes = Change.objects.filter(Q(user_id=user_id) | Q(user__isnull=True))
+
+        settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+        if "since" not in request.query_params:
+            seq = changes.filter(created_at__lte=settled).order_by("-id").values_list("id", flat=True).first() or 0
+            return Response({"changes": [], "next": self.get_token(user_id, seq), "has_more": False})
+
+        seq = self.get_seq(request)
+        if seq is None:
+            return Response({"detail": "Sync token expired, fetch everything again."}, status=410)
+
+        limit = self.get_limit(request)
+        page = list(changes.filter(id__gt=seq).order_by("id")[:limit + 1])
+        for index, change in enumerate(page):
+            if change.created_at > settled:
+                page = page[:index]
+                break
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        # only the latest change of an object in the page is returned
+        latest = {}
+        for change in page:
+            key = (change.kind, change.object_id) if change.kind != Change.READ else ("read", change.id)
+            latest.pop(key, None)
+            latest[key] = change
+        page = sorted(latest.values(), key=lambda change: change.id)
+
+        objects = self.get_objects(request, page)
+        results = []
+        for change in page:
+            data = change.data if change.kind == Change.READ else objects.get((change.kind, change.object_id))
+            if not change.deleted and data is None:
+                # deleted since, its tombstone follows
+                continue
+            results.append({
+                "seq": change.id,
+                "type": change.kind,
+                "id": change.object_id,
+                "deleted": change.deleted,
+                "data": None if change.deleted else data,
+            })
+
+        next_seq = page[-1].id if page else seq
+        return Response({"changes": results, "next": self.get_token(user_id, next_seq), "has_more": has_more})
+
+    def get_objects(self, request, page):
+        from user_control.serializers import UserProfileSerializer
+        from user_control.views import UserProfileView
+
+        ids = {Change.MESSAGE: set(), Change.PROFILE: set()}
+        for change in page:
+            if change.kind in ids and not change.deleted:
+                ids[change.kind].add(change.object_id)
+
+        objects = {}
+        context = {"request": request}
+        if ids[Change.MESSAGE]:
+            messages = MessageView.queryset.filter(id__in=ids[Change.MESSAGE])
+            for data in MessageSerializer(messages, many=True, context=context).data:
+                objects[Change.MESSAGE, data["id"]] = data
+        if ids[Change.PROFILE]:
+            profiles = UserProfileView.queryset.filter(id__in=ids[Change.PROFILE])
+            for data in UserProfileSerializer(profiles, many=True, context=context).data:
+                objects[Change.PROFILE, data["id"]] = data
+        return objects
+
+
+class MessageSearchView(ListAPIView):
+    """
+    Searches the text of the caller's messages, optionally within the
+    conversation with user_id. Every term has to match, results are ranked
+    and come with a snippet around the first match.
+    """
+    serializer_class = MessageSearchSerializer
+    permission_classes = (IsAuthenticatedCustom, )
+    use_read_replica = True
+    pagination_class = MessageSearchPagination
+
+    def get_terms(self):
+        terms = tokenize(self.request.query_params.get("q", ""))
+        if not terms:
+            raise ValidationError({"q": "This field is required."})
+        return terms
+
+    def get_queryset(self):
+        user_id = self.request.user.id
+        messages = MessageView.queryset
+        other_user_id = self.request.query_params.get("user_id", None)
+        if other_user_id:
+            messages = messages.filter(conversation_key=Message.get_conversation_key(user_id, other_user_id))
+        else:
+            messages = messages.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+        return search_messages(messages, self.get_terms())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["search_terms"] = self.get_terms()
+        return context
+
+
+class UnreadCountView(APIView):
+    permission_classes = (IsAuthenticatedCustom, )
+
+    def get(self, request):
+        return Response({"total": get_unread_total(request.user.id)})
+
+
+class InboxPagination(KeysetPagination):
+    ordering = ("-last_message_at", "-id")
+    legacy_query_param = None
+
+
+class InboxView(ListAPIView):
+    serializer_class = ConversationSerializer
+    permission_classes = (IsAuthenticatedCustom, )
+    use_read_replica = True
+    pagination_class = InboxPagination
+
+    def get_queryset(self):
+        user_id = self.request.user.id
+        return Conversation.objects.select_related(
+            "first_user__user_profile__profile_picture__blob", "second_user__user_profile__profile_picture__blob"
+        ).filter(
+            Q(first_user_id=user_id) | Q(second_user_id=user_id), last_message_at__isnull=False)
@@ -1,10 +1,94 @@
 import jwt
+import threading
+from collections import OrderedDict
 from django.conf import settings
+from django.core.cache import cache
 from datetime import datetime
 from rest_framework.authentication import BaseAuthentication
 from .models import CustomUser, Jwt
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of access tokens whose signature has already been checked,
+    shared by every thread of the process.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            claims = self._data.get(token, None)
+            if claims is None:
+                return None
+            if datetime.now().timestamp() > claims["exp"]:
+                del self._data[token]
+                return None
+            self._data.move_to_end(token)
+            return claims
+
+    def set(self, token, claims):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[token] = claims
+            self._data.move_to_end(token)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+verified_tokens = VerifiedTokenCache(settings.JWT_VERIFIED_TOKEN_CACHE_SIZE)
+
+
+def token_version_key(user_id):
+    return f"token_version:{user_id}"
+
+
+class TokenUser:
+    """
+    Request principal built from the signed access token claims.
+
+    The CustomUser row is only fetched the first time a view reads an
+    attribute that is not part of the claims.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.id = claims["user_id"]
+        self.pk = self.id
+        self.username = claims["username"]
+        self.is_staff = claims.get("is_staff", False)
+        self.token_version = claims.get("token_version", 0)
+        self._user = None
+
+    def get_user(self):
+        if self._user is None:
+            self._user = CustomUser.objects.get(id=self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_user":
+            raise AttributeError(name)
+        return getattr(self.get_user(), name)
+
+    def __eq__(self, other):
+        return isinstance(other, (TokenUser, CustomUser)) and self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
 class Authentication(BaseAuthentication):
 
     def authenticate(self, request):
@@ -12,11 +96,13 @@ class Authentication(BaseAuthentication):
         if not data:
             return None, None
 
-        return self.get_user(data["user_id"]), None
+        return self.get_user(data), None
 
-    def get_user(self, user_id):
+    def get_user(self, claims):
+        if settings.JWT_STATELESS_AUTH and "username" in claims:
+            return TokenUser(claims)
         try:
-            user = CustomUser.objects.get(id=user_id)
+            user = CustomUser.objects.get(id=claims["user_id"])
             return user
         except Exception:
             return None
@@ -26,13 +112,29 @@ class Authentication(BaseAuthentication):
         if not authorization:
             return None
         token = headers["Authorization"][7:]
-        decoded_data = Authentication.verify_token(token)
+        decoded_data = Authentication.verify_access_token(token)
 
         if not decoded_data:
             return None
 
         return decoded_data
 
+    @staticmethod
+    def verify_access_token(token):
+        decoded_data = verified_tokens.get(token)
+        if not decoded_data:
+            decoded_data = Authentication.verify_token(token)
+            if not decoded_data or "user_id" not in decoded_data:
+                return None
+            verified_tokens.set(token, decoded_data)
+
+        # tokens issued before the user's last logout are no longer valid
+        current_version = cache.get(token_version_key(decoded_data["user_id"]))
+        if current_version is not None and decoded_data.get("token_version", 0) < current_version:
+            return None
+
+        return decoded_data
+
     @staticmethod
     def verify_token(token):
         # decode the token
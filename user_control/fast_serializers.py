@@ -0,0 +1,51 @@
+from chatapi.fast_serializers import FastSerializer, attribute, datetime_attribute, method, nested, pk_list
+from message_control.fast_serializers import FastGenericFileUploadSerializer
+from message_control.serializers import get_unread_counts, get_viewer_id
+
+
+class FastCustomUserSerializer(FastSerializer):
+    field_accessors = (
+        ("id", attribute("id")),
+        ("last_login", datetime_attribute("last_login")),
+        ("username", attribute("username")),
+        ("email", attribute("email")),
+        ("created_at", datetime_attribute("created_at")),
+        ("updated_at", datetime_attribute("updated_at")),
+        ("is_staff", attribute("is_staff")),
+        ("is_superuser", attribute("is_superuser")),
+        ("is_active", attribute("is_active")),
+        ("is_online", datetime_attribute("is_online")),
+        ("groups", pk_list("groups")),
+        ("user_permissions", pk_list("user_permissions")),
+    )
+
+
+class FastUserProfileSerializer(FastSerializer):
+    """
+    UserProfileSerializer's read output, for the profile listing and the
+    profiles nested in messages.
+    """
+    field_accessors = (
+        ("id", attribute("id")),
+        ("user", nested("user", FastCustomUserSerializer)),
+        ("profile_picture", nested("profile_picture", FastGenericFileUploadSerializer)),
+        ("message_count", method("get_message_count")),
+        ("first_name", attribute("first_name")),
+        ("last_name", attribute("last_name")),
+        ("caption", attribute("caption")),
+        ("about", attribute("about")),
+        ("created_at", datetime_attribute("created_at")),
+        ("updated_at", datetime_attribute("updated_at")),
+    )
+
+    def to_representation_many(self, profiles):
+        self.context["unread_counts"] = get_unread_counts(
+            get_viewer_id(self.context), [profile.user_id for profile in profiles])
+        return super().to_representation_many(profiles)
+
+    def get_message_count(self, obj):
+        unread_counts = self.context.get("unread_counts", None)
+        if unread_counts is not None:
+            return unread_counts.get(obj.user_id, 0)
+
+        return get_unread_counts(get_viewer_id(self.context), [obj.user_id]).get(obj.user_id, 0)
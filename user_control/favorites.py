@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from .models import Favorite
+
+FavoriteLink = Favorite.favorite.through
+
+
+def favorites_key(user_id):
+    return f"favorites:{user_id}"
+
+
+def get_favorite_ids(user_id):
+    """
+    Ids of the users `user_id` has marked as favorite, served from the
+    shared cache and loaded with one query on a miss.
+    """
+    favorite_ids = cache.get(favorites_key(user_id))
+    if favorite_ids is None:
+        favorite_ids = set(FavoriteLink.objects.filter(
+            favorite__user_id=user_id).values_list("customuser_id", flat=True))
+        cache.set(favorites_key(user_id), favorite_ids, timeout=settings.FAVORITES_CACHE_TIMEOUT)
+    return favorite_ids
+
+
+def toggle_favorite(user_id, favorite_id):
+    """
+    Adds or removes favorite_id from the user's favorites and returns
+    whether it is a favorite afterwards.
+    """
+    with transaction.atomic():
+        favorite, _ = Favorite.objects.get_or_create(user_id=user_id)
+        removed, _ = FavoriteLink.objects.filter(
+            favorite_id=favorite.id, customuser_id=favorite_id).delete()
+        if not removed:
+            try:
+                with transaction.atomic():
+                    FavoriteLink.objects.create(favorite_id=favorite.id, customuser_id=favorite_id)
+            except IntegrityError:
+                # added by a concurrent request
+                pass
+
+    cache.delete(favorites_key(user_id))
+    return not removed
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from chatapi.checks import is_local_cache
+from user_control import response_cache
+
+
+class Command(BaseCommand):
+    help = "Shows the hit and miss counts of the profile listing cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after printing them")
+
+    def handle(self, *args, **options):
+        if is_local_cache("profiles"):
+            raise CommandError(
+                "The profiles cache is local to each worker process, which log their own counters "
+                "(user_control.response_cache). Set PROFILE_CACHE_BACKEND to a shared cache to collect them.")
+
+        stats = response_cache.get_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+        self.stdout.write(f"hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {ratio:.1%}")
+
+        if options["reset"]:
+            response_cache.reset_stats()
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_search_document(apps, schema_editor):
+    from user_control.search import build_search_document
+
+    UserProfile = apps.get_model('user_control', 'UserProfile')
+    profiles = UserProfile.objects.using(schema_editor.connection.alias).select_related('user').order_by('id')
+
+    last_id = 0
+    while True:
+        batch = list(profiles.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        for profile in batch:
+            profile.search_document = build_search_document(profile, profile.user)
+        UserProfile.objects.using(schema_editor.connection.alias).bulk_update(batch, ['search_document'])
+        last_id = batch[-1].id
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS user_profile_search_trgm_idx ON user_control_userprofile '
+        'USING gin (search_document gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS user_profile_search_trgm_idx')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('user_control', '0004_customuser_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_document, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
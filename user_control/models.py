@@ -1,7 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from message_control.changes import log_profile_change
 from message_control.models import GenericFileUpload
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
+from . import response_cache
 
 
 class CustomUserManager(BaseUserManager):
@@ -38,13 +42,50 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_superuser = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     is_online = models.DateTimeField(default=timezone.now)
+    token_version = models.PositiveIntegerField(default=0)
 
     USERNAME_FIELD = "username"
     objects = CustomUserManager()
 
+    # copied into the profiles' search document
+    indexed_fields = ("username", "email")
+    # shown with the profile in cached listings
+    listed_fields = ("last_login", "username", "email", "created_at", "updated_at", "is_staff", "is_superuser",
+                     "is_active", "is_online")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # deferred fields are left out, reading them would query
+        instance._indexed = instance.get_loaded_indexed_fields()
+        return instance
+
     def __str__(self):
         return self.username
 
+    def get_loaded_indexed_fields(self):
+        return {name: self.__dict__[name] for name in self.indexed_fields if name in self.__dict__}
+
+    def indexed_fields_changed(self):
+        loaded = getattr(self, "_indexed", None)
+        if loaded is None:
+            return True
+        return any(name in self.__dict__ and (name not in loaded or loaded[name] != self.__dict__[name])
+                   for name in self.indexed_fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields", None)
+        if update_fields is None or set(update_fields) & set(self.listed_fields):
+            response_cache.invalidate(self.id)
+
+        # presence and login updates leave the profile search document alone
+        if self.indexed_fields_changed():
+            self._indexed = self.get_loaded_indexed_fields()
+            for profile in UserProfile.objects.filter(user_id=self.id):
+                profile.user = self
+                profile.save(update_fields=["search_document", "updated_at"])
+
     class Meta:
         ordering = ("created_at",)
 
@@ -58,16 +99,33 @@ class UserProfile(models.Model):
     about = models.TextField()
     profile_picture = models.ForeignKey(
         GenericFileUpload, related_name="user_image", on_delete=models.SET_NULL, null=True)
+    search_document = models.TextField(blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        from .search import build_search_document
+        search_document = build_search_document(self, self.user)
+        # new and renamed profiles may show up in any listing or search
+        listed = self._state.adding or search_document != self.search_document
+        self.search_document = search_document
+        super().save(*args, **kwargs)
+        log_profile_change(self.id)
+        response_cache.invalidate(None if listed else self.user_id)
+
     class Meta:
         ordering = ("created_at",)
 
 
+@receiver(post_delete, sender=UserProfile)
+def log_profile_deletion(sender, instance, **kwargs):
+    log_profile_change(instance.id, deleted=True)
+    response_cache.invalidate()
+
+
 class Favorite(models.Model):
     user = models.OneToOneField(CustomUser, related_name="user_favorites", on_delete=models.CASCADE)
     favorite = models.ManyToManyField(CustomUser, related_name="user_favoured")
@@ -0,0 +1,130 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceBuffer:
+    """
+    Collects last-seen times in memory and writes them to CustomUser.is_online
+    in bulk, recording each user at most once per throttle window.
+    """
+
+    def __init__(self, throttle_seconds, batch_size=500):
+        self.throttle = timedelta(seconds=throttle_seconds)
+        self.batch_size = batch_size
+        self._pending = {}
+        self._recorded = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            last = self._recorded.get(user_id, None)
+            if last and now - last < self.throttle:
+                return False
+            self._recorded[user_id] = now
+            self._pending[user_id] = now
+        return True
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # forget users whose throttle window has passed
+            cutoff = timezone.now() - self.throttle
+            self._recorded = {
+                user_id: seen for user_id, seen in self._recorded.items() if seen > cutoff}
+        return pending
+
+    def requeue(self, pending):
+        with self._lock:
+            for user_id, seen in pending.items():
+                current = self._pending.get(user_id, None)
+                if not current or current < seen:
+                    self._pending[user_id] = seen
+
+    def flush(self):
+        pending = self.drain()
+        if not pending:
+            return 0
+
+        try:
+            self.write(pending)
+        except Exception:
+            logger.exception("Unable to flush presence for %s users", len(pending))
+            self.requeue(pending)
+            return 0
+        return len(pending)
+
+    def write(self, pending):
+        users = [CustomUser(id=user_id, is_online=seen) for user_id, seen in pending.items()]
+        CustomUser.objects.bulk_update(users, ["is_online"], batch_size=self.batch_size)
+
+
+class PresenceFlusher(threading.Thread):
+
+    def __init__(self, buffer, interval):
+        super().__init__(name="presence-flusher", daemon=True)
+        self.buffer = buffer
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.buffer.flush()
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+presence = PresenceBuffer(settings.PRESENCE_THROTTLE_SECONDS)
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def get_presence_window():
+    # is_online moves at most once per throttle window and logs no change,
+    # listings showing it put the window in their version
+    return int(time.time() // max(settings.PRESENCE_THROTTLE_SECONDS, 1))
+
+
+def flush_at_exit():
+    pending = presence.drain()
+    if not pending:
+        return
+    try:
+        presence.write(pending)
+    except DatabaseError:
+        # e.g. the test database is already gone
+        logger.warning("Dropping the last seen time of %s users at exit", len(pending))
+
+
+def start_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            atexit.register(flush_at_exit)
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = PresenceFlusher(presence, settings.PRESENCE_FLUSH_INTERVAL)
+            _flusher.start()
+    return _flusher
+
+
+def record_presence(user_id):
+    if not presence.touch(user_id):
+        return
+    if settings.PRESENCE_FLUSH_INTERVAL <= 0:
+        # no background thread, written once per throttle window
+        presence.flush()
+    elif _flusher is None:
+        start_flusher()
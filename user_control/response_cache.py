@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+from django.conf import settings
+from django.core.cache import caches
+from chatapi.checks import is_local_cache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "generation"
+STATS_KEYS = ("hits", "misses")
+# every worker logs its own counters once per this many lookups
+STATS_LOG_EVERY = 1000
+process_stats = dict.fromkeys(STATS_KEYS, 0)
+
+
+def get_cache():
+    return caches["profiles"]
+
+
+def get_generation():
+    generation = get_cache().get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        get_cache().add(GENERATION_KEY, generation, timeout=None)
+    return generation
+
+
+def get_row_key(user_id):
+    return f"user:{user_id}"
+
+
+def invalidate(user_id=None):
+    """
+    Drops the cached listings showing the profile of user_id, or every
+    cached listing when user_id is None, for profiles that are added,
+    removed or may match other searches. Entries of older generations are
+    never read again and expire with their timeout.
+    """
+    key = GENERATION_KEY if user_id is None else get_row_key(user_id)
+    try:
+        get_cache().incr(key)
+    except ValueError:
+        get_cache().set(key, 2, timeout=None)
+
+
+def get_row_versions(user_ids):
+    versions = get_cache().get_many([get_row_key(user_id) for user_id in user_ids])
+    return [versions.get(get_row_key(user_id), 1) for user_id in user_ids]
+
+
+def get_key(user_id, favorite_ids, query_params):
+    # favorites change the viewer's ordering, so they are part of the key
+    fingerprint = json.dumps([sorted(favorite_ids), sorted(query_params.lists())])
+    digest = hashlib.md5(fingerprint.encode()).hexdigest()
+    return f"list:{get_generation()}:{user_id}:{digest}"
+
+
+def count(name):
+    process_stats[name] += 1
+    if sum(process_stats.values()) % STATS_LOG_EVERY == 0:
+        logger.info("Profile cache of process %s: %s hits, %s misses",
+                    os.getpid(), process_stats["hits"], process_stats["misses"])
+    if is_local_cache("profiles"):
+        # profile_cache_stats could not read them
+        return
+    try:
+        get_cache().incr(name)
+    except ValueError:
+        get_cache().add(name, 1, timeout=None)
+
+
+def load(key):
+    if not settings.PROFILE_CACHE_ENABLED:
+        return None
+    entry = get_cache().get(key)
+    # entries are dropped when a profile they show changed since
+    if entry is not None and entry["versions"] != get_row_versions(entry["users"]):
+        entry = None
+    count("hits" if entry is not None else "misses")
+    return None if entry is None else entry["data"]
+
+
+def store(key, data, user_ids):
+    if settings.PROFILE_CACHE_ENABLED:
+        get_cache().set(key, {"data": data, "users": user_ids, "versions": get_row_versions(user_ids)})
+
+
+def get_stats():
+    stats = get_cache().get_many(STATS_KEYS)
+    return {name: stats.get(name, 0) for name in STATS_KEYS}
+
+
+def reset_stats():
+    get_cache().delete_many(STATS_KEYS)
@@ -0,0 +1,44 @@
+import re
+import unicodedata
+from django.db.models import Case, IntegerField, Q, Value, When
+from chatapi.pagination import KeysetPagination
+
+# fields are joined with a newline so a search term never matches across two fields
+FIELD_SEPARATOR = "\n"
+
+
+def normalize_text(value):
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", value).strip().lower()
+
+
+def build_search_document(profile, user):
+    fields = (user.username, profile.first_name, profile.last_name, user.email)
+    return FIELD_SEPARATOR.join(normalize_text(field) for field in fields)
+
+
+def get_search_filter(terms):
+    """
+    Every term has to appear in the document. On PostgreSQL the LIKE scans
+    are served by the trigram index on search_document.
+    """
+    query = Q()
+    for term in terms:
+        query &= Q(search_document__contains=term)
+    return query
+
+
+def get_search_rank(terms):
+    # one point for each term that starts a field
+    rank = Value(0, output_field=IntegerField())
+    for term in terms:
+        rank = rank + Case(
+            When(Q(search_document__startswith=term) |
+                 Q(search_document__contains=FIELD_SEPARATOR + term), then=Value(1)),
+            default=Value(0), output_field=IntegerField())
+    return rank
+
+
+class ProfileSearchPagination(KeysetPagination):
+    ordering = ("-fav_count", "-search_rank", "id")
@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from .models import UserProfile, CustomUser, Favorite
-from message_control.serializers import GenericFileUploadSerializer
+from django.db.models import Manager
+from message_control.serializers import (
+    GenericFileUploadSerializer, SparseFieldsMixin, get_unread_counts, get_viewer_id
+)
 
 
 class LoginSerializer(serializers.Serializer):
@@ -22,7 +25,16 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CustomUser
-        exclude = ("password", )
+        exclude = ("password", "token_version")
+
+
+class UserProfileListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        profiles = list(data.all() if isinstance(data, Manager) else data)
+        self.context["unread_counts"] = get_unread_counts(
+            get_viewer_id(self.context), [profile.user_id for profile in profiles])
+        return super().to_representation(profiles)
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -35,18 +47,51 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserProfile
-        fields = "__all__"
+        exclude = ("search_document", )
+        list_serializer_class = UserProfileListSerializer
 
     def get_message_count(self, obj):
-        try:
-            user_id = self.context["request"].user.id
-        except Exception as e:
-            user_id = None
+        unread_counts = self.context.get("unread_counts", None)
+        if unread_counts is not None:
+            return unread_counts.get(obj.user_id, 0)
 
-        from message_control.models import Message
-        message = Message.objects.filter(sender_id=obj.user.id, receiver_id=user_id, is_read=False).distinct()
+        return get_unread_counts(get_viewer_id(self.context), [obj.user_id]).get(obj.user_id, 0)
+
+
+class CompactUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    first_name = serializers.CharField(source="user_profile.first_name", read_only=True)
+    last_name = serializers.CharField(source="user_profile.last_name", read_only=True)
+    profile_picture = serializers.SerializerMethodField("get_profile_picture")
+    message_count = serializers.SerializerMethodField("get_message_count")
 
-        return message.count()
+    class Meta:
+        model = CustomUser
+        fields = ("id", "username", "first_name", "last_name", "profile_picture", "is_online", "message_count")
+
+    def get_profile_picture(self, obj):
+        try:
+            picture = obj.user_profile.profile_picture
+        except UserProfile.DoesNotExist:
+            return None
+        if picture is None:
+            return None
+        url = picture.file_upload.url
+        request = self.context.get("request", None)
+        return request.build_absolute_uri(url) if request else url
+
+    def get_message_count(self, obj):
+        return self.context["unread_counts"].get(obj.id, 0)
+
+
+def get_user_table(user_ids, context, fields=None):
+    """
+    The compact profiles of `user_ids` with one query, for the side-table
+    of compact listings.
+    """
+    users = CustomUser.objects.filter(id__in=user_ids).select_related(
+        "user_profile__profile_picture").order_by("id")
+    context = dict(context, unread_counts=get_unread_counts(get_viewer_id(context), user_ids))
+    return CompactUserSerializer(users, many=True, context=context, fields=fields).data
 
 
 class FavoriteSerializer(serializers.Serializer):
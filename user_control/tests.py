@@ -1,7 +1,28 @@
 from rest_framework.test import APITestCase
+from django.test import override_settings
 from .views import get_random, get_access_token, get_refresh_token
 from .models import CustomUser, UserProfile
-from message_control.tests import create_image, SimpleUploadedFile
+from message_control.tests import MEDIA_ROOT, SHARED_CACHES, create_image, SimpleUploadedFile
+import shutil
+import tempfile
+
+# listings and hit counters shared with the profile_cache_stats process
+SHARED_PROFILE_CACHES = dict(SHARED_CACHES, profiles={
+    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tempfile.mkdtemp(),
+    "KEY_PREFIX": "profiles"})
+
+
+# requests would start the presence flusher thread, which locks the test database
+NO_PRESENCE_FLUSHER = override_settings(PRESENCE_FLUSH_INTERVAL=0)
+
+
+def setUpModule():
+    NO_PRESENCE_FLUSHER.enable()
+
+
+def tearDownModule():
+    NO_PRESENCE_FLUSHER.disable()
+    shutil.rmtree(SHARED_PROFILE_CACHES["profiles"]["LOCATION"], ignore_errors=True)
 
 
 class TestGenericFunctions(APITestCase):
@@ -252,3 +273,398 @@ class TestUserInfo(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["user"]["username"], "tester")
+
+
+class TestStatelessAuth(APITestCase):
+    login_url = "/user/login"
+    logout_url = "/user/logout"
+    me_url = "/user/me"
+
+    def setUp(self):
+        payload = {
+            "username": "adefemigreat",
+            "password": "ade123",
+            "email": "adefemigreat@yahoo.com"
+        }
+
+        self.user = CustomUser.objects.create_user(**payload)
+
+        # login
+        response = self.client.post(self.login_url, data=payload)
+        result = response.json()
+
+        self.bearer = 'Bearer {}'.format(result['access'])
+
+    def tearDown(self):
+        from django.core.cache import cache
+        from .authentication import verified_tokens
+        cache.clear()
+        verified_tokens.clear()
+
+    def test_decode_without_user_lookup(self):
+        from .views import decodeJWT
+        from .authentication import TokenUser
+
+        with self.assertNumQueries(0):
+            user = decodeJWT(self.bearer)
+
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user.username, "adefemigreat")
+
+        # model fields are loaded lazily and only once
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "adefemigreat@yahoo.com")
+            self.assertEqual(user.email, "adefemigreat@yahoo.com")
+
+    def test_logout_revokes_token(self):
+        response = self.client.get(self.me_url, HTTP_AUTHORIZATION=self.bearer)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.logout_url, HTTP_AUTHORIZATION=self.bearer)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.me_url, HTTP_AUTHORIZATION=self.bearer)
+        self.assertEqual(response.status_code, 403)
+
+
+class TestPresence(APITestCase):
+
+    def test_touch_is_throttled_and_flushed_in_bulk(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .presence import PresenceBuffer
+
+        users = [
+            CustomUser.objects.create_user(
+                username=f"user{i}", password="user123", email=f"user{i}@yahoo.com")
+            for i in range(3)
+        ]
+        buffer = PresenceBuffer(throttle_seconds=30)
+        now = timezone.now() + timedelta(minutes=1)
+
+        for user in users:
+            self.assertTrue(buffer.touch(user.id, now=now))
+        # repeated requests inside the window are coalesced
+        self.assertFalse(buffer.touch(users[0].id, now=now + timedelta(seconds=5)))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+
+        for user in users:
+            user.refresh_from_db()
+            self.assertEqual(user.is_online, now)
+
+        # nothing left to write
+        with self.assertNumQueries(0):
+            self.assertEqual(buffer.flush(), 0)
+
+    @override_settings(PRESENCE_FLUSH_INTERVAL=0)
+    def test_written_in_the_request_without_flusher(self):
+        from unittest import mock
+        from . import presence
+
+        user = CustomUser.objects.create_user(username="user", password="user123", email="user@yahoo.com")
+        # other tests' users share the ids within the throttle window
+        buffer = presence.PresenceBuffer(throttle_seconds=30)
+        with mock.patch.object(presence, "presence", buffer), self.assertNumQueries(1):
+            presence.record_presence(user.id)
+        self.assertIsNone(presence._flusher)
+        self.assertGreater(CustomUser.objects.get(id=user.id).is_online, user.is_online)
+
+        # nothing pending for the exit hook
+        with mock.patch.object(presence, "presence", buffer), self.assertNumQueries(0):
+            presence.flush_at_exit()
+
+
+class ProfileTestCase(APITestCase):
+    profile_url = "/user/profile"
+    login_url = "/user/login"
+
+    def setUp(self):
+        payload = {
+            "username": "viewer",
+            "password": "viewer123",
+            "email": "viewer@yahoo.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            'HTTP_AUTHORIZATION': 'Bearer {}'.format(response.json()['access'])}
+
+    def create_profile(self, username, first_name, last_name):
+        user = CustomUser.objects.create_user(
+            username=username, password="tester123", email=f"{username}@yahoo.com")
+        return UserProfile.objects.create(user=user, first_name=first_name, last_name=last_name,
+                                          caption="it's all about testing", about="I'm a youtuber")
+
+    def search(self, keyword, **params):
+        response = self.client.get(self.profile_url, data={"keyword": keyword, **params}, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+class TestProfileSearch(ProfileTestCase):
+
+    def test_search_document_is_normalized_and_kept_in_sync(self):
+        profile = self.create_profile("tester", "Adéfemi", "Oseni")
+        self.assertEqual(profile.search_document, "tester\nadefemi\noseni\ntester@yahoo.com")
+
+        profile.user.username = "renamed"
+        profile.user.save()
+        profile.refresh_from_db()
+        self.assertTrue(profile.search_document.startswith("renamed\n"))
+
+        # other user updates leave the profile alone
+        updated_at = profile.updated_at
+        profile.user.is_online = profile.user.is_online
+        profile.user.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.updated_at, updated_at)
+
+        # deferred fields are neither loaded nor mistaken for a rename
+        self.assertEqual(CustomUser.objects.only("id").get(id=profile.user_id).username, "renamed")
+        user = CustomUser.objects.defer("email").get(id=profile.user_id)
+        with self.assertNumQueries(1):
+            user.save(update_fields=["is_online"])
+        user = CustomUser.objects.get(id=profile.user_id)
+        user.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.updated_at, updated_at)
+
+    def test_search_document_is_not_exposed(self):
+        from message_control.models import Message
+
+        profile = self.create_profile("tester", "Adefemi", "Oseni")
+        UserProfile.objects.create(user=self.user, first_name="Viewer", last_name="User", caption="", about="")
+        Message.objects.create(sender=profile.user, receiver=self.user, message="hello")
+
+        for fast in (True, False):
+            with self.settings(FAST_SERIALIZERS_ENABLED=fast, PROFILE_CACHE_ENABLED=False):
+                profiles = self.search("")["results"]
+                self.assertNotIn("search_document", profiles[0])
+                messages = self.client.get(
+                    "/message/message", data={"user_id": profile.user_id}, **self.bearer).json()["results"]
+                self.assertNotIn("search_document", messages[0]["sender"])
+        me = self.client.get("/user/me", **self.bearer).json()
+        self.assertNotIn("search_document", me)
+        self.assertEqual(me["first_name"], "Viewer")
+
+    def test_search_is_ranked(self):
+        self.create_profile("vester", "Mango", "Madeline")
+        self.create_profile("tester", "Adefemi", "Oseni")
+        self.create_profile("other", "Bolu", "Ade")
+
+        result = self.search("ade")["results"]
+        # matches at the start of a field rank above matches inside a word
+        self.assertEqual([row["user"]["username"] for row in result], ["tester", "other", "vester"])
+
+        # quoted phrases stay within a single field
+        self.assertEqual(len(self.search('"adefemi oseni"')["results"]), 0)
+        self.assertEqual(len(self.search("adefemi oseni")["results"]), 1)
+
+    def test_search_is_paginated_by_keyset(self):
+        for i in range(5):
+            self.create_profile(f"tester{i}", "Adefemi", "Oseni")
+
+        first_page = self.search("adefemi", page_size=3)
+        second_page = self.client.get(first_page["next"], **self.bearer).json()
+
+        usernames = [row["user"]["username"] for row in first_page["results"] + second_page["results"]]
+        self.assertEqual(usernames, [f"tester{i}" for i in range(5)])
+        self.assertIsNone(second_page["next"])
+
+
+class TestFavorites(ProfileTestCase):
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_toggle_and_check(self):
+        first = self.create_profile("first", "Adefemi", "Oseni")
+        second = self.create_profile("second", "Adefemi", "Oseni")
+
+        response = self.client.post("/user/update-favorite", data={"favorite_id": second.user_id}, **self.bearer)
+        self.assertEqual(response.json(), "added")
+
+        # favorites are ranked first without a correlated subquery
+        result = self.search("adefemi")["results"]
+        self.assertEqual([row["user"]["username"] for row in result], ["second", "first"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f"/user/check-favorites?ids={first.user_id},{second.user_id}", **self.bearer)
+        self.assertEqual(response.json(), [second.user_id])
+
+        response = self.client.get(f"/user/check-favorite/{second.user_id}", **self.bearer)
+        self.assertEqual(response.json(), True)
+
+        response = self.client.post("/user/update-favorite", data={"favorite_id": second.user_id}, **self.bearer)
+        self.assertEqual(response.json(), "removed")
+
+        response = self.client.get(f"/user/check-favorite/{second.user_id}", **self.bearer)
+        self.assertEqual(response.json(), False)
+
+    def test_local_cache_with_several_workers(self):
+        from chatapi.checks import check_shared_cache
+
+        self.assertEqual(check_shared_cache(None), [])
+        with self.settings(WEB_CONCURRENCY=4):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ["chatapi.E001"])
+
+
+class TestConditionalRequests(ProfileTestCase):
+    me_url = "/user/me"
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def get(self, url, etag=None):
+        headers = dict(self.bearer)
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        return self.client.get(url, **headers)
+
+    def test_me(self):
+        profile = UserProfile.objects.create(user=self.user, first_name="viewer", last_name="viewer",
+                                             caption="caption", about="about")
+        response = self.get(self.me_url)
+        etag = response["ETag"]
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(1):
+            response = self.get(self.me_url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        profile.caption = "changed"
+        profile.save()
+        response = self.get(self.me_url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["caption"], "changed")
+
+    def test_profile_list(self):
+        other = self.create_profile("other", "Other", "User")
+        etag = self.get(self.profile_url)["ETag"]
+        self.assertEqual(self.get(self.profile_url, etag).status_code, 304)
+
+        # the query string is part of the tag
+        self.assertEqual(self.get(self.profile_url + "?keyword=other", etag).status_code, 200)
+
+        self.client.post("/user/update-favorite", data={"favorite_id": other.user_id}, **self.bearer)
+        response = self.get(self.profile_url, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.create_profile("new", "New", "User")
+        self.assertEqual(self.get(self.profile_url, etag).status_code, 200)
+
+
+@override_settings(CACHES=SHARED_PROFILE_CACHES)
+class TestProfileResponseCache(ProfileTestCase):
+
+    def setUp(self):
+        from django.core.cache import caches
+        # other tests leave listings and counters behind
+        caches["profiles"].clear()
+        super().setUp()
+
+    def tearDown(self):
+        from django.core.cache import caches
+        caches["default"].clear()
+        caches["profiles"].clear()
+
+    def test_cached_and_invalidated(self):
+        from django.core.management import CommandError, call_command
+        from io import StringIO
+        from user_control import response_cache
+
+        profile = self.create_profile("other", "Other", "User")
+        self.search("other")
+
+        # a hit only runs the two ETag aggregates
+        with self.assertNumQueries(2):
+            result = self.search("other")["results"]
+        self.assertEqual(result[0]["caption"], "it's all about testing")
+        self.assertEqual(response_cache.get_stats(), {"hits": 1, "misses": 1})
+
+        # a change only drops the listings showing the profile
+        unrelated = self.search("nobody")
+        profile.caption = "changed"
+        profile.save()
+        self.assertEqual(self.search("other")["results"][0]["caption"], "changed")
+        self.assertEqual(self.search("nobody"), unrelated)
+        self.assertEqual(response_cache.get_stats(), {"hits": 2, "misses": 3})
+
+        stdout = StringIO()
+        call_command("profile_cache_stats", stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), "hits: 2, misses: 3, hit ratio: 40.0%")
+        with self.settings(CACHES=SHARED_CACHES), self.assertRaises(CommandError):
+            call_command("profile_cache_stats", stdout=stdout)
+
+        profile.user.email = "changed@yahoo.com"
+        profile.user.save()
+        self.assertEqual(self.search("other")["results"][0]["user"]["email"], "changed@yahoo.com")
+
+        # user fields shown in the listing drop the pages showing the user
+        profile.user.is_staff = True
+        profile.user.save()
+        self.assertTrue(self.search("other")["results"][0]["user"]["is_staff"])
+        self.assertEqual(self.search("nobody"), unrelated)
+        stats = response_cache.get_stats()
+        profile.user.save(update_fields=["token_version"])
+        self.search("other")
+        self.assertEqual(response_cache.get_stats()["hits"], stats["hits"] + 1)
+
+        # toggling a favorite reorders the viewer's listing
+        second = self.create_profile("second", "Other", "Person")
+        self.assertEqual([row["user"]["username"] for row in self.search("other")["results"]], ["other", "second"])
+        self.client.post("/user/update-favorite", data={"favorite_id": second.user_id}, **self.bearer)
+        self.assertEqual([row["user"]["username"] for row in self.search("other")["results"]], ["second", "other"])
+
+    def test_unread_counts_are_fresh_on_hits(self):
+        from message_control.models import Message
+
+        profile = self.create_profile("other", "Other", "User")
+        self.assertEqual(self.search("other")["results"][0]["message_count"], 0)
+
+        bearer = self.client.post(self.login_url, data={"username": "other", "password": "tester123"}).json()
+        self.client.post("/message/message", data={
+            "sender_id": profile.user_id, "receiver_id": self.user.id, "message": "hi"
+        }, HTTP_AUTHORIZATION=f"Bearer {bearer['access']}")
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(self.search("other")["results"][0]["message_count"], 1)
+
+
+@override_settings(PROFILE_CACHE_ENABLED=False, DEFAULT_FILE_STORAGE="chatapi.storage_backends.LocalMediaStorage",
+                   MEDIA_ROOT=MEDIA_ROOT)
+class TestFastProfileSerializer(ProfileTestCase):
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_listing_parity(self):
+        from django.contrib.auth.models import Group
+        from message_control.models import GenericFileUpload, Message
+
+        upload = GenericFileUpload.objects.create(
+            file_upload=SimpleUploadedFile("front1.png", create_image(None, "avatar.png").getvalue()))
+        first = self.create_profile("first", "First", "User")
+        first.profile_picture = upload
+        first.save()
+        second = self.create_profile("second", "Second", "User")
+        second.user.groups.add(Group.objects.create(name="testers"))
+        Message.objects.create(sender_id=second.user_id, receiver_id=self.user.id, message="hello")
+
+        for params in ({"page_size": 1}, {"keyword": "user"}, {"page": 1}, {}):
+            with override_settings(FAST_SERIALIZERS_ENABLED=False):
+                slow = self.client.get(self.profile_url, data=params, **self.bearer)
+            fast = self.client.get(self.profile_url, data=params, **self.bearer)
+            self.assertEqual(fast.content, slow.content)
+        self.assertIn(b"front1", fast.content)
+        self.assertIn(b'"message_count":1', fast.content)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from .views import (
     LoginView, RegisterView, RefreshView, UserProfileView, MeView, LogoutView,
-    UpdateFavoriteView, CheckIsFavoriteView
+    UpdateFavoriteView, CheckIsFavoriteView, CheckFavoritesView
 )
 from rest_framework.routers import DefaultRouter
 
@@ -18,4 +18,5 @@ urlpatterns = [
     path('logout', LogoutView.as_view()),
     path('update-favorite', UpdateFavoriteView.as_view()),
     path('check-favorite/<int:favorite_id>', CheckIsFavoriteView.as_view()),
+    path('check-favorites', CheckFavoritesView.as_view()),
 ]
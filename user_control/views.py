@@ -1,5 +1,5 @@
 import jwt
-from .models import Jwt, CustomUser, Favorite
+from .models import Jwt, CustomUser
 from datetime import datetime, timedelta
 from django.conf import settings
 import random
@@ -10,11 +10,20 @@ from .serializers import (
 )
 from django.contrib.auth import authenticate
 from rest_framework.response import Response
-from .authentication import Authentication
+from .fast_serializers import FastUserProfileSerializer
+from .authentication import Authentication, TokenUser, token_version_key
+from chatapi.conditional import ConditionalGetMixin
 from chatapi.custom_methods import IsAuthenticatedCustom
+from message_control.models import Change, Conversation
 from rest_framework.viewsets import ModelViewSet
 import re
-from django.db.models import Q, Count, Subquery, OuterRef
+from django.db.models import Q, F, Case, When, Value, IntegerField, Count, Max
+from .favorites import get_favorite_ids, toggle_favorite
+from .presence import get_presence_window
+from . import response_cache
+from message_control.unread import get_unread_counts
+from .search import ProfileSearchPagination, normalize_text, get_search_filter, get_search_rank
+from django.core.cache import cache
 
 
 def get_random(length):
@@ -23,12 +32,21 @@ def get_random(length):
 
 def get_access_token(payload):
     return jwt.encode(
-        {"exp": datetime.now() + timedelta(minutes=5), **payload},
+        {"exp": datetime.now() + settings.JWT_ACCESS_TOKEN_LIFETIME, **payload},
         settings.SECRET_KEY,
         algorithm="HS256"
     )
 
 
+def get_token_claims(user):
+    return {
+        "user_id": user.id,
+        "username": user.username,
+        "is_staff": user.is_staff,
+        "token_version": user.token_version,
+    }
+
+
 def get_refresh_token():
     return jwt.encode(
         {"exp": datetime.now() + timedelta(days=365), "data": get_random(10)},
@@ -42,12 +60,17 @@ def decodeJWT(bearer):
         return None
 
     token = bearer[7:]
-    decoded = jwt.decode(token, key=settings.SECRET_KEY)
-    if decoded:
-        try:
-            return CustomUser.objects.get(id=decoded["user_id"])
-        except Exception:
-            return None
+    decoded = Authentication.verify_access_token(token)
+    if not decoded:
+        return None
+
+    if settings.JWT_STATELESS_AUTH and "username" in decoded:
+        return TokenUser(decoded)
+
+    try:
+        return CustomUser.objects.get(id=decoded["user_id"])
+    except Exception:
+        return None
 
 
 class LoginView(APIView):
@@ -66,7 +89,7 @@ class LoginView(APIView):
 
         Jwt.objects.filter(user_id=user.id).delete()
 
-        access = get_access_token({"user_id": user.id})
+        access = get_access_token(get_token_claims(user))
         refresh = get_refresh_token()
 
         Jwt.objects.create(
@@ -105,7 +128,7 @@ class RefreshView(APIView):
         if not Authentication.verify_token(serializer.validated_data["refresh"]):
             return Response({"error": "Token is invalid or has expired"})
 
-        access = get_access_token({"user_id": active_jwt.user.id})
+        access = get_access_token(get_token_claims(active_jwt.user))
         refresh = get_refresh_token()
 
         active_jwt.access = access.decode()
@@ -115,77 +138,111 @@ class RefreshView(APIView):
         return Response({"access": access, "refresh": refresh})
 
 
-class UserProfileView(ModelViewSet):
-    queryset = UserProfile.objects.all()
+def get_profile_version(profiles):
+    version = profiles.aggregate(
+        count=Count("id"), profile=Max("updated_at"), user=Max("user__updated_at"), online=Max("user__is_online"))
+    return version, max(filter(None, (version["profile"], version["user"], version["online"])), default=None)
+
+
+class UserProfileView(ConditionalGetMixin, ModelViewSet):
+    queryset = UserProfile.objects.select_related("user", "profile_picture__blob").prefetch_related(
+        "user__groups", "user__user_permissions")
     serializer_class = UserProfileSerializer
     permission_classes = (IsAuthenticatedCustom, )
+    use_read_replica = True
+    pagination_class = ProfileSearchPagination
 
     def get_queryset(self):
         if self.request.method.lower() != "get":
             return self.queryset
 
         data = self.request.query_params.dict()
-        data.pop("page", None)
+        for param in ("page", "page_size", "before", "after"):
+            data.pop(param, None)
         keyword = data.pop("keyword", None)
 
-        if keyword:
-            search_fields = (
-                "user__username", "first_name", "last_name", "user__email"
-            )
-            query = self.get_query(keyword, search_fields)
-            try:
-                return self.queryset.filter(query).filter(**data).exclude(
-                    Q(user_id=self.request.user.id) |
-                    Q(user__is_superuser=True)
-                ).annotate(
-                    fav_count=Count(self.user_fav_query(self.request.user))
-                ).order_by("-fav_count")
-            except Exception as e:
-                raise Exception(e)
-
         result = self.queryset.filter(**data).exclude(
             Q(user_id=self.request.user.id) |
             Q(user__is_superuser=True)
         ).annotate(
-            fav_count=Count(self.user_fav_query(self.request.user))
-        ).order_by("-fav_count")
-        return result
+            fav_count=self.user_fav_query(self.request.user)
+        )
 
-    @staticmethod
-    def user_fav_query(user):
-        try:
-            return user.user_favorites.favorite.filter(id=OuterRef("user_id")).values("pk")
-        except Exception:
-            return []
+        if keyword:
+            terms = [normalize_text(term) for term in self.normalize_query(keyword)]
+            result = result.filter(get_search_filter(terms)).annotate(
+                search_rank=get_search_rank(terms))
+        else:
+            result = result.annotate(search_rank=Value(0, output_field=IntegerField()))
+
+        return result.order_by(*self.pagination_class.ordering)
+
+    def get_serializer_class(self):
+        if self.action == "list" and settings.FAST_SERIALIZERS_ENABLED:
+            return FastUserProfileSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        """
+        Pages are cached per viewer, favorites and query string, the unread
+        badges are laid over cached pages since they change far more often.
+        """
+        key = response_cache.get_key(request.user.id, get_favorite_ids(request.user.id), request.query_params)
+        data = response_cache.load(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            profiles = response.data["results"] if isinstance(response.data, dict) else response.data
+            response_cache.store(key, response.data, [profile["user"]["id"] for profile in profiles])
+            return response
+
+        profiles = data["results"] if isinstance(data, dict) else data
+        unread_counts = get_unread_counts(request.user.id, [profile["user"]["id"] for profile in profiles])
+        for profile in profiles:
+            profile["message_count"] = unread_counts.get(profile["user"]["id"], 0)
+        return Response(data)
+
+    def get_version(self, request):
+        user_id = request.user.id
+        if self.action == "retrieve":
+            version, last_modified = get_profile_version(UserProfile.objects.filter(pk=self.kwargs["pk"]))
+        else:
+            # every profile save goes to the shared change feed
+            version = {
+                "profiles": Change.objects.filter(user__isnull=True).order_by("-id").values_list(
+                    "id", flat=True).first(),
+                "presence": get_presence_window(),
+                # favorites change the ordering but carry no timestamp
+                "favorites": sorted(get_favorite_ids(user_id)),
+            }
+            last_modified = None
 
+        # unread badges
+        version["conversations"] = Conversation.objects.filter(
+            Q(first_user_id=user_id) | Q(second_user_id=user_id)).aggregate(updated=Max("updated_at"))["updated"]
+        if last_modified and version["conversations"]:
+            last_modified = max(last_modified, version["conversations"])
+        return version, last_modified
 
     @staticmethod
-    def get_query(query_string, search_fields):
-        query = None  # Query to search for every search term
-        terms = UserProfileView.normalize_query(query_string)
-        for term in terms:
-            or_query = None  # Query to search for a given term in each field
-            for field_name in search_fields:
-                q = Q(**{"%s__icontains" % field_name: term})
-                if or_query is None:
-                    or_query = q
-                else:
-                    or_query = or_query | q
-            if query is None:
-                query = or_query
-            else:
-                query = query & or_query
-        return query
+    def user_fav_query(user):
+        favorite_ids = get_favorite_ids(user.id)
+        if not favorite_ids:
+            return Value(0, output_field=IntegerField())
+        return Case(When(user_id__in=favorite_ids, then=Value(1)), default=Value(0), output_field=IntegerField())
 
     @staticmethod
     def normalize_query(query_string, findterms=re.compile(r'"([^"]+)"|(\S+)').findall, normspace=re.compile(r'\s{2,}').sub):
         return [normspace(' ', (t[0] or t[1]).strip()) for t in findterms(query_string)]
 
 
-class MeView(APIView):
+class MeView(ConditionalGetMixin, APIView):
     permission_classes = (IsAuthenticatedCustom, )
+    use_read_replica = True
     serializer_class = UserProfileSerializer
 
+    def get_version(self, request):
+        return get_profile_version(UserProfile.objects.filter(user_id=request.user.id))
+
     def get(self, request):
         data = {}
         try:
@@ -207,6 +264,12 @@ class LogoutView(APIView):
 
         Jwt.objects.filter(user_id=user_id).delete()
 
+        # invalidate access tokens that are still cached or in flight
+        CustomUser.objects.filter(id=user_id).update(
+            token_version=F("token_version") + 1)
+        cache.set(token_version_key(user_id), request.user.token_version + 1,
+                  timeout=settings.JWT_ACCESS_TOKEN_LIFETIME.total_seconds())
+
         return Response("logged out successfully", status=200)
 
 
@@ -217,23 +280,13 @@ class UpdateFavoriteView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        try:
-            favorite_user = CustomUser.objects.get(id=serializer.validated_data["favorite_id"])
-        except Exception:
+        favorite_id = serializer.validated_data["favorite_id"]
+        if not CustomUser.objects.filter(id=favorite_id).exists():
             raise Exception("Favorite user does not exist")
 
-        try:
-            fav = request.user.user_favorites
-        except Exception:
-            fav = Favorite.objects.create(user_id=request.user.id)
-
-        favorite = fav.favorite.filter(id=favorite_user.id)
-        if favorite:
-            fav.favorite.remove(favorite_user)
-            return Response("removed")
-
-        fav.favorite.add(favorite_user)
-        return Response("added")
+        if toggle_favorite(request.user.id, favorite_id):
+            return Response("added")
+        return Response("removed")
 
 
 class CheckIsFavoriteView(APIView):
@@ -241,11 +294,17 @@ class CheckIsFavoriteView(APIView):
 
     def get(self, request, *args, **kwargs):
         favorite_id = kwargs.get("favorite_id", None)
+        return Response(favorite_id in get_favorite_ids(request.user.id))
+
+
+class CheckFavoritesView(APIView):
+    permission_classes = (IsAuthenticatedCustom,)
+
+    def get(self, request, *args, **kwargs):
         try:
-            favorite = request.user.user_favorites.favorite.filter(id=favorite_id)
-            if favorite:
-                return Response(True)
-            return Response(False)
-        except Exception:
-            return Response(False)
+            ids = [int(favorite_id) for favorite_id in request.query_params.get("ids", "").split(",") if favorite_id]
+        except ValueError:
+            return Response({"error": "ids must be a comma separated list of user ids"}, status=400)
 
+        favorite_ids = get_favorite_ids(request.user.id)
+        return Response([favorite_id for favorite_id in ids if favorite_id in favorite_ids])